@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+import tempfile
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +13,95 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Apply pending migrations in create_app(), or leave it to "flask db-upgrade"
+DB_AUTO_UPGRADE = os.getenv("DB_AUTO_UPGRADE", "true").lower() == "true"
+
+# Connection pool of each worker, see service/utils/pool.py
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),  # seconds
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # seconds
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+
+# Seconds the database check of /health/ready is cached
+HEALTH_CHECK_TTL = float(os.getenv("HEALTH_CHECK_TTL", "5"))
+# Seconds the check waits to connect, keep it below the probe's timeoutSeconds
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+
+# Count the SQL statements of each request, see service/utils/query_stats.py,
+# and warn when an endpoint runs more than its budget. QUERY_BUDGETS sets
+# the budget of single endpoints, like "wishlist_export=1,clear_resource=3"
+QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "true").lower() == "true"
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "10"))
+QUERY_BUDGETS = {
+    endpoint.strip(): int(budget)
+    for endpoint, budget in (
+        entry.split("=") for entry in os.getenv("QUERY_BUDGETS", "").split(",") if entry
+    )
+}
+
+# Logging, see service/utils/log_handlers.py. LOG_FORMAT is text or json.
+# LOG_LEVELS sets the level of single loggers, like
+# "service.models=WARNING,sqlalchemy.engine=INFO", and LOG_SAMPLE_RATES keeps
+# the routine INFO lines of only a fraction of the requests to an endpoint,
+# like "wishlist_resource=0.01,liveness=0", LOG_SAMPLE_RATE for the others
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_LEVELS = {
+    name.strip(): level.strip()
+    for name, level in (
+        entry.split("=") for entry in os.getenv("LOG_LEVELS", "").split(",") if entry
+    )
+}
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = {
+    endpoint.strip(): float(rate)
+    for endpoint, rate in (
+        entry.split("=")
+        for entry in os.getenv("LOG_SAMPLE_RATES", "").split(",")
+        if entry
+    )
+}
+
+# Opt-in profiling of single requests, see service/utils/profiling.py. A
+# request is profiled when it sends PROFILE_SECRET in the X-Profile header,
+# or at random at PROFILE_SAMPLE_RATE. PROFILE_ENGINE is auto, cprofile or
+# sampling, which needs pyinstrument and is picked by auto when installed
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ENGINE = os.getenv("PROFILE_ENGINE", "auto").lower()
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "wishlists-profiles")
+)
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+# Keyset pagination for GET /api/wishlists
+WISHLIST_PAGE_SIZE = int(os.getenv("WISHLIST_PAGE_SIZE", "100"))
+WISHLIST_PAGE_SIZE_MAX = int(os.getenv("WISHLIST_PAGE_SIZE_MAX", "1000"))
+
+# Largest array accepted by POST /api/wishlists/{id}/items:batch
+ITEM_BATCH_SIZE_MAX = int(os.getenv("ITEM_BATCH_SIZE_MAX", "1000"))
+
+# Read-through cache of GET /api/wishlists/{id}, a TTL of 0 disables it. Entries
+# are checked against the wishlist version, so other workers' writes are seen
+WISHLIST_CACHE_TTL = float(os.getenv("WISHLIST_CACHE_TTL", "30"))
+WISHLIST_CACHE_SIZE = int(os.getenv("WISHLIST_CACHE_SIZE", "1024"))
+# Import path of the CacheBackend class, like a shared store for all of the workers
+WISHLIST_CACHE_BACKEND = os.getenv(
+    "WISHLIST_CACHE_BACKEND", "service.models.LRUCacheBackend"
+)
+
+# Compiled response serializers and orjson encoding, see service/utils/serializers.py
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "true").lower() == "true"
+
+# Response compression, see service/utils/compression.py
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # bytes
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))  # gzip, 1-9
+COMPRESS_BR_LEVEL = int(os.getenv("COMPRESS_BR_LEVEL", "4"))  # brotli, 0-11
+COMPRESS_MIMETYPES = ["application/json", "text/html", "text/css"]
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
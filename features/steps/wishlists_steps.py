@@ -30,11 +30,16 @@ from compare import expect
 @given("the following wishlists")
 def step_impl(context):
     """Delete all Wishlists and load new ones"""
-    # List all of the wishlists and delete them one by one
+    # List all of the wishlists, page by page, and delete them one by one
     rest_endpoint = f"{context.BASE_URL}/api/wishlists"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
-    for wishlist in context.resp.json():
+    wishlists = []
+    next_url = rest_endpoint
+    while next_url:
+        context.resp = requests.get(next_url)
+        expect(context.resp.status_code).to_equal(200)
+        wishlists.extend(context.resp.json())
+        next_url = context.resp.links.get("next", {}).get("url")
+    for wishlist in wishlists:
         context.resp = requests.delete(f"{rest_endpoint}/{wishlist['id']}")
         expect(context.resp.status_code).to_equal(204)
 
@@ -0,0 +1,180 @@
+"""
+Gunicorn Configuration
+
+Loaded by gunicorn from the working directory. Every setting here can be
+overridden on the command line or with the environment variables below.
+
+The number of workers and threads is sized from the CPU and memory limits
+of the container, read from its cgroup, rather than from the CPUs of the
+node it runs on:
+
+  GUNICORN_WORKERS          worker processes, by default 2 x CPUs + 1,
+                            as many as fit in GUNICORN_WORKER_MEMORY
+  GUNICORN_THREADS          threads per sync worker, by default enough
+                            to make up for workers that did not fit
+  GUNICORN_WORKER_MEMORY    MiB used by one worker, 64 by default
+  GUNICORN_WORKER_CLASS     sync, the default, or gevent to serve up to
+                            GUNICORN_WORKER_CONNECTIONS requests at once
+                            in each worker while they wait on PostgreSQL
+  GUNICORN_MAX_REQUESTS     requests before a worker is replaced, 1000
+  GUNICORN_PRELOAD          true to load the app in the master, the
+                            default except with gevent
+  PROMETHEUS_MULTIPROC_DIR  where the workers keep their metrics, which
+                            /metrics adds up, emptied at every start
+"""
+import math
+import os
+import shutil
+import tempfile
+
+CGROUP = "/sys/fs/cgroup"
+MAX_THREADS = 8
+
+
+def read_cgroup(root: str, *paths):
+    """Returns the content of the first cgroup file that exists, or None"""
+    for path in paths:
+        try:
+            with open(os.path.join(root, path), encoding="ascii") as file:
+                return file.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit(root: str = CGROUP) -> float:
+    """Returns the CPUs this container may use, which can be a fraction"""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:  # pragma: no cover
+        cpus = float(os.cpu_count() or 1)
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    value = read_cgroup(root, "cpu.max")
+    if value:
+        quota, period = value.split()
+        if quota != "max":
+            cpus = min(cpus, int(quota) / int(period))
+        return cpus
+    # cgroup v1: a quota of -1 means no limit
+    quota = read_cgroup(root, "cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")
+    period = read_cgroup(root, "cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        cpus = min(cpus, int(quota) / int(period))
+    return cpus
+
+
+def memory_limit(root: str = CGROUP):
+    """Returns the memory limit of this container in bytes, or None"""
+    value = read_cgroup(root, "memory.max", "memory/memory.limit_in_bytes")
+    if not value or value == "max":
+        return None
+    limit = int(value)
+    # cgroup v1 reports no limit as a huge number
+    return limit if limit < 2**60 else None
+
+
+def size_workers(cpus: float, memory, worker_memory: int):
+    """
+    Returns the number of workers and of threads per worker
+
+    Starts from the usual 2 x CPUs + 1 workers. When the memory limit only
+    fits fewer of them, besides the master, threads make up the difference,
+    as a thread costs far less memory than a process.
+    """
+    wanted = 2 * math.ceil(cpus) + 1
+    count = wanted
+    if memory is not None:
+        count = max(1, min(wanted, memory // worker_memory - 1))
+    threads = min(MAX_THREADS, math.ceil(wanted / count))
+    return count, threads
+
+
+CPUS = cpu_limit()
+MEMORY = memory_limit()
+auto_workers, auto_threads = size_workers(
+    CPUS, MEMORY, int(os.getenv("GUNICORN_WORKER_MEMORY", "64")) * 2**20
+)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GUNICORN_WORKERS", str(auto_workers)))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+# Replace workers now and then, at different times, to bound memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+if worker_class == "gevent":
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+    # Concurrent requests share the pool of their worker. Size it for the
+    # queries in flight at once rather than one per request, and keep
+    # workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) below max_connections.
+    os.environ.setdefault("DB_POOL_SIZE", "10")
+    os.environ.setdefault("DB_MAX_OVERFLOW", "20")
+    os.environ.setdefault("DB_POOL_TIMEOUT", "10")
+    # The app must be loaded in each worker, after gevent has patched
+    # threading, so the locks the app creates on import are cooperative
+    preload_default = "false"
+else:
+    # more than one thread turns the sync workers into gthread workers
+    threads = int(os.getenv("GUNICORN_THREADS", str(auto_threads)))
+    # one connection per thread, without waiting on the pool
+    os.environ.setdefault("DB_POOL_SIZE", str(max(5, threads)))
+    # Importing the app opens no connection, so it is safe to load it, and
+    # migrate the schema, once in the master before forking the workers
+    preload_default = "true"
+
+preload_app = os.getenv("GUNICORN_PRELOAD", preload_default).lower() == "true"
+
+# Set before the app is loaded, which creates the metrics, and emptied so
+# the counters of the last run are not added to those of this one
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "wishlists-metrics")
+)
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    """Logs the settings chosen for this container"""
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+
+    # the master serves no request, leave its gauges, like the pool
+    # it migrated the schema with, out of the sums of the workers
+    multiprocess.mark_process_dead(os.getpid(), metrics_dir)
+    cfg = server.cfg
+    server.log.info(
+        "Container limits: %.2f CPUs, %s memory",
+        CPUS,
+        f"{MEMORY // 2**20} MiB" if MEMORY else "unlimited",
+    )
+    server.log.info(
+        "Running %d %s with %d threads, preload %s, "
+        "max_requests %d + up to %d, timeout %ds",
+        cfg.workers,
+        cfg.worker_class.__name__,
+        cfg.threads,
+        "on" if cfg.preload_app else "off",
+        cfg.max_requests,
+        cfg.max_requests_jitter,
+        cfg.timeout,
+    )
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the gauges of a worker that is gone"""
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
+
+
+def post_worker_init(worker):
+    """Lets psycopg2 yield to other greenlets in gevent workers"""
+    if worker.cfg.worker_class_str.startswith("gevent"):
+        # pylint: disable=import-outside-toplevel
+        from service.utils.green import patch_psycopg
+
+        patch_psycopg()
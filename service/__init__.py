@@ -2,13 +2,17 @@
 Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
-and SQL database
+and SQL database. Importing it does not connect to the database, the
+schema is migrated by create_app() or by the db-upgrade command.
 """
 import sys
+import time
 from flask import Flask
 from flask_restx import Api
 from service.utils import log_handlers
 
+STARTED = time.perf_counter()
+
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object("config")
@@ -29,8 +33,9 @@ api = Api(
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order
-from service import routes  # noqa: F401, E402
-from service.utils import error_handlers, cli_commands  # noqa: F401, E402
+from service import routes, models  # noqa: F401, E402
+from service.utils import error_handlers, cli_commands, compression  # noqa: F401, E402
+from service.utils import query_stats, metrics, profiling  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
@@ -39,11 +44,27 @@ app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our SQLAlchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+# Connections are opened lazily, on the first query of each worker
+models.init_app(app)
+
+
+def create_app():
+    """
+    Returns the app, after migrating the database schema once
+
+    Run gunicorn with --preload "service:create_app()" so this runs in the
+    master before it forks the workers, which then boot without touching
+    the database. Set DB_AUTO_UPGRADE to false to leave the schema to the
+    db-upgrade command.
+    """
+    if app.config["DB_AUTO_UPGRADE"]:
+        try:
+            models.upgrade_schema(app)  # make our SQLAlchemy tables
+        except Exception as error:  # pylint: disable=broad-except
+            app.logger.critical("%s: Cannot continue", error)
+            # gunicorn requires exit code 4 to stop spawning workers when they die
+            sys.exit(4)
 
-app.logger.info("Service initialized!")
+    app.config["STARTUP_TIME"] = time.perf_counter() - STARTED
+    app.logger.info("Service initialized in %.3f seconds", app.config["STARTUP_TIME"])
+    return app
@@ -0,0 +1,38 @@
+"""
+Creates the wishlist and item tables
+
+The tables are defined here as they first shipped, rather than taken from
+the models, so that this script keeps building the same schema when the
+models change. Databases made by db.create_all() already have them.
+"""
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, Numeric, String, Table
+
+metadata = MetaData()
+
+Table(
+    "wishlist",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(63), nullable=False),
+    Column("customer_id", Integer, nullable=False),
+)
+
+Table(
+    "item",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column(
+        "wishlist_id",
+        Integer,
+        ForeignKey("wishlist.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    Column("product_id", Integer, nullable=False),
+    Column("product_name", String(63), nullable=False),
+    Column("product_price", Numeric, nullable=False),
+)
+
+
+def upgrade(connection):
+    """Creates the tables that do not exist"""
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,12 @@
+"""
+Adds the version of a wishlist, bumped by every change, for its ETag
+
+PostgreSQL adds a column with a constant default without rewriting the
+table, so this is quick however many wishlists there are.
+"""
+from service.migrations import add_column
+
+
+def upgrade(connection):
+    """Adds wishlist.version"""
+    add_column(connection, "wishlist", "version", "INTEGER DEFAULT 1 NOT NULL")
@@ -0,0 +1,70 @@
+"""
+Indexes the wishlist lookups, and makes a product unique in a wishlist
+
+The indexes are built concurrently, so the tables stay writable while
+this runs against a live database. Items added twice to a wishlist by
+concurrent requests before the constraint existed would fail the unique
+index, so the migration stops and lists them instead. Merge or delete
+them by hand, or keep the oldest of each with "flask
+delete-duplicate-items", then migrate again.
+"""
+from sqlalchemy import text
+from service.migrations import MigrationError, create_index, find_duplicate_items
+
+TRANSACTIONAL = False
+
+# duplicates listed in the error, the rest are only counted
+SHOWN_DUPLICATES = 20
+
+
+def check_duplicate_items(connection):
+    """Raises a MigrationError listing the items repeating a product"""
+    duplicates = find_duplicate_items(connection)
+    if not duplicates:
+        return
+    lines = [
+        f"wishlist {wishlist_id} product {product_id}: items {ids}"
+        for (wishlist_id, product_id), ids in list(duplicates.items())[
+            :SHOWN_DUPLICATES
+        ]
+    ]
+    if len(duplicates) > SHOWN_DUPLICATES:
+        lines.append(f"and {len(duplicates) - SHOWN_DUPLICATES} more")
+    raise MigrationError(
+        f"{len(duplicates)} products are repeated in their wishlist, which the "
+        "unique index on item (wishlist_id, product_id) forbids:\n  "
+        + "\n  ".join(lines)
+        + "\nResolve them by hand, or keep the oldest item of each with "
+        '"flask delete-duplicate-items", then migrate again.'
+    )
+
+
+def upgrade(connection):
+    """Creates the indexes and the unique constraint of item"""
+    create_index(
+        connection, "ix_wishlist_customer_id_name", "wishlist", ["customer_id", "name"]
+    )
+    create_index(connection, "ix_wishlist_name", "wishlist", ["name"])
+    check_duplicate_items(connection)
+    create_index(
+        connection,
+        "uq_item_wishlist_id_product_id",
+        "item",
+        ["wishlist_id", "product_id"],
+        unique=True,
+    )
+    if connection.dialect.name != "postgresql":
+        return
+    # ON CONFLICT ON CONSTRAINT needs a constraint, not only a unique index
+    exists = connection.execute(
+        text(
+            "SELECT 1 FROM pg_constraint WHERE conname = 'uq_item_wishlist_id_product_id'"
+        )
+    ).scalar()
+    if not exists:
+        connection.execute(
+            text(
+                "ALTER TABLE item ADD CONSTRAINT uq_item_wishlist_id_product_id "
+                "UNIQUE USING INDEX uq_item_wishlist_id_product_id"
+            )
+        )
@@ -0,0 +1,236 @@
+"""
+Schema Migrations
+
+The database schema is built by the versioned scripts of this package,
+applied in order by "flask db-upgrade". Each script is a module named
+NNNN_description.py with an upgrade(connection) function, and the
+versions applied are recorded in the schema_migrations table.
+
+A script runs in its own transaction, unless it sets TRANSACTIONAL to
+False, which CREATE INDEX CONCURRENTLY needs on PostgreSQL. Those scripts
+must be safe to run again, as they can be interrupted half way. On
+PostgreSQL a session advisory lock is held while migrating, so when many
+workers or pods start at once only one of them changes the schema.
+"""
+import importlib
+import logging
+import pkgutil
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key of the migrations, "wish" in ASCII
+LOCK_ID = 0x77697368
+
+SCRIPT_NAME = re.compile(r"^(\d{4})_(\w+)$")
+
+version_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String(4), primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class MigrationError(Exception):
+    """Used when a migration cannot be applied to the data as it is"""
+
+    pass
+
+
+class Migration:
+    """One versioned migration script"""
+
+    def __init__(self, version: str, name: str):
+        self.version = version
+        self.name = name
+
+    def __repr__(self):
+        return f"<Migration {self.version}_{self.name}>"
+
+    @property
+    def module(self):
+        """Returns the module of the script"""
+        return importlib.import_module(f"{__name__}.{self.version}_{self.name}")
+
+    @property
+    def transactional(self) -> bool:
+        """Returns False if the script must run outside of a transaction"""
+        return getattr(self.module, "TRANSACTIONAL", True)
+
+
+def discover() -> list:
+    """Returns the migration scripts of this package in version order"""
+    migrations = []
+    for module in pkgutil.iter_modules(__path__):
+        match = SCRIPT_NAME.match(module.name)
+        if match:
+            migrations.append(Migration(*match.groups()))
+    return sorted(migrations, key=lambda migration: migration.version)
+
+
+def applied_versions(connection) -> set:
+    """Returns the versions already applied to the database"""
+    if not inspect(connection).has_table(version_table.name):
+        return set()
+    return set(connection.execute(select(version_table.c.version)).scalars())
+
+
+def pending(engine) -> list:
+    """Returns the migrations not applied yet"""
+    with engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [migration for migration in discover() if migration.version not in applied]
+
+
+@contextmanager
+def advisory_lock(connection):
+    """Holds the migration lock, waiting for any other process to release it"""
+    if connection.dialect.name != "postgresql":
+        # SQLite only has one writer at a time anyway
+        yield
+        return
+    connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": LOCK_ID})
+    try:
+        yield
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": LOCK_ID})
+
+
+def _apply(connection, migration):
+    """Runs one migration on the autocommit connection and records its version"""
+    logger.info("Applying migration %s_%s", migration.version, migration.name)
+    record = version_table.insert().values(
+        version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+    )
+    if not migration.transactional:
+        migration.module.upgrade(connection)
+        connection.execute(record)
+        return
+    # the isolation level is set on the DBAPI connection, so switch it back
+    # to the default for the transaction, and to autocommit after it
+    level = connection.dialect.default_isolation_level
+    transactional = connection.execution_options(isolation_level=level)
+    try:
+        with transactional.begin():
+            migration.module.upgrade(transactional)
+            transactional.execute(record)
+    finally:
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+
+
+def upgrade(engine, target: str = None, report=None) -> list:
+    """
+    Applies the pending migrations up to and including target
+
+    Everything runs on the one connection that holds the lock, so this
+    works even with a pool of a single connection.
+
+    :param engine: the engine of the database to migrate
+    :param target: the last version to apply, by default all of them
+    :param report: called with each Migration before it is applied
+
+    :return: the migrations applied
+    :rtype: list
+
+    """
+    applied = []
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        with advisory_lock(connection):
+            version_table.create(connection, checkfirst=True)
+            # read after taking the lock, another process may have migrated
+            done = applied_versions(connection)
+            for migration in discover():
+                if target is not None and migration.version > target:
+                    break
+                if migration.version in done:
+                    continue
+                if report:
+                    report(migration)
+                _apply(connection, migration)
+                applied.append(migration)
+    return applied
+
+
+######################################################################
+# Helpers of the migration scripts
+######################################################################
+def add_column(connection, table: str, column: str, definition: str):
+    """Adds a column to a table unless it has it already"""
+    columns = {entry["name"] for entry in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        )
+
+
+def find_duplicate_items(connection) -> dict:
+    """Returns the ids of the items repeating a product of their wishlist
+
+    The ids are listed by (wishlist_id, product_id), the oldest first.
+    """
+    rows = connection.execute(
+        text(
+            "SELECT a.wishlist_id, a.product_id, a.id FROM item a WHERE EXISTS "
+            "(SELECT 1 FROM item b WHERE b.wishlist_id = a.wishlist_id "
+            "AND b.product_id = a.product_id AND b.id <> a.id) "
+            "ORDER BY a.wishlist_id, a.product_id, a.id"
+        )
+    )
+    duplicates = {}
+    for wishlist_id, product_id, item_id in rows:
+        duplicates.setdefault((wishlist_id, product_id), []).append(item_id)
+    return duplicates
+
+
+def delete_duplicate_items(connection) -> int:
+    """Deletes the items repeating a product of their wishlist, keeping the oldest"""
+    if connection.dialect.name == "postgresql":
+        statement = (
+            "DELETE FROM item a USING item b WHERE a.wishlist_id = b.wishlist_id "
+            "AND a.product_id = b.product_id AND a.id > b.id"
+        )
+    else:
+        statement = (
+            "DELETE FROM item WHERE id NOT IN "
+            "(SELECT MIN(id) FROM item GROUP BY wishlist_id, product_id)"
+        )
+    return connection.execute(text(statement)).rowcount
+
+
+def create_index(connection, name: str, table: str, columns: list, unique=False):
+    """
+    Creates an index unless it exists
+
+    On PostgreSQL it is built CONCURRENTLY, so writes to the table go on
+    while it is built, and the script must not be TRANSACTIONAL. An
+    invalid index left by an interrupted build is dropped first.
+    """
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if connection.dialect.name != "postgresql":
+        connection.execute(
+            text(
+                f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+            )
+        )
+        return
+    valid = connection.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ),
+        {"name": name},
+    ).scalar()
+    if valid is False:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(
+        text(
+            f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {table} ({', '.join(columns)})"
+        )
+    )
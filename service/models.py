@@ -4,9 +4,19 @@ Models for Wishlist
 All of the models are stored in this module
 """
 import logging
+import threading
+import time
+from collections import OrderedDict
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import literal_column, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from werkzeug.utils import import_string
+from service import migrations
+from service.utils import pool
 
-logger = logging.getLogger("service.app")
+logger = logging.getLogger(__name__)
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
@@ -17,12 +27,214 @@ def init_db(app):
     Wishlist.init_db(app)
 
 
+def init_app(app):
+    """Configures SQLAlchemy for the app without connecting to the database
+
+    Connections are only opened by the first query, so a worker forked
+    after this never shares a connection with its parent.
+    """
+    pool.init_app(app)
+    db.init_app(app)
+    cache.init_app(app)
+
+
+def upgrade_schema(app, target=None, report=None):
+    """Applies the pending schema migrations, see service/migrations
+
+    The connections used are closed afterwards, so this can run in the
+    gunicorn master before it forks the workers.
+    """
+    logger.info("Upgrading the database schema")
+    with app.app_context():
+        applied = migrations.upgrade(db.engine, target, report)
+        db.engine.dispose()
+    return applied
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
     pass
 
 
+class CacheBackend:
+    """
+    Interface of the key/value stores that can back the WishlistCache
+
+    A shared store (e.g. Redis) can implement it so that every worker
+    process sees the same entries and invalidations. WISHLIST_CACHE_BACKEND
+    names the class to use, which from_config() builds from the app config.
+    """
+
+    @classmethod
+    def from_config(cls, config):  # pylint: disable=unused-argument
+        """Returns a backend configured from the Flask app config"""
+        return cls()
+
+    def get(self, key):
+        """Returns the value stored under key, or None if there is none"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl: float):
+        """Stores value under key for ttl seconds"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes key from the store"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every key from the store"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Returns the figures of the store to show with the cache counters"""
+        return {}
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In-process least recently used cache whose entries expire after a TTL
+
+    Entries are private to each worker process, which fills its own.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("WISHLIST_CACHE_SIZE", 1024))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self), "maxsize": self.maxsize}
+
+
+class WishlistCache:
+    """
+    Read-through cache of serialized Wishlists with their items
+
+    Model methods that write a wishlist or its items invalidate its entry
+    after they commit. As the cache may be per process, and a concurrent miss
+    can store a row read before a write, an entry is only served while its
+    version matches the one in the database, so a hit still costs the
+    primary key lookup of Wishlist.find_version() but never loads the items.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = 30):
+        self.backend = backend or LRUCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Configures the cache from the Flask app config"""
+        self.ttl = app.config.get("WISHLIST_CACHE_TTL", self.ttl)
+        backend = app.config.get("WISHLIST_CACHE_BACKEND")
+        if isinstance(backend, str):
+            backend = import_string(backend)
+        if backend:
+            self.backend = backend.from_config(app.config)
+
+    @staticmethod
+    def key(wishlist_id: int) -> str:
+        """Returns the cache key of a Wishlist"""
+        return f"wishlist:{wishlist_id}"
+
+    def get_wishlist(self, wishlist_id: int, version: int = None) -> dict:
+        """Returns a serialized Wishlist with its items, or None if not found
+
+        :param wishlist_id: the id of the Wishlist to find
+        :type wishlist_id: int
+
+        :param version: the version of the Wishlist, when the caller has
+            already looked it up with Wishlist.find_version()
+        :type version: int
+
+        :return: the Wishlist from the cache if it is current, or else from
+            the database
+        :rtype: dict
+
+        """
+        if self.ttl <= 0:
+            wishlist = Wishlist.find(wishlist_id)
+            return wishlist.serialize_with_items() if wishlist else None
+
+        key = self.key(wishlist_id)
+        if version is None:
+            version = Wishlist.find_version(wishlist_id)
+        if version is None:
+            self.misses += 1
+            self.backend.delete(key)
+            return None
+
+        data = self.backend.get(key)
+        if data is not None and data["version"] == version:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        wishlist = Wishlist.find(wishlist_id)
+        if not wishlist:
+            return None
+        data = wishlist.serialize_with_items()
+        self.backend.set(key, data, self.ttl)
+        return data
+
+    def invalidate(self, *wishlist_ids):
+        """Removes the entries of the given Wishlists"""
+        for wishlist_id in wishlist_ids:
+            self.backend.delete(self.key(wishlist_id))
+
+    def clear(self):
+        """Removes every entry and resets the counters"""
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache"""
+        stats = {"hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+        stats.update(self.backend.stats())
+        return stats
+
+
+# The cache of single Wishlist lookups, configured in init_db()
+cache = WishlistCache()
+
+
 class Wishlist(db.Model):
     """
     Class that represents a Wishlist
@@ -34,6 +246,15 @@ class Wishlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(63), nullable=False)
     customer_id = db.Column(db.Integer, nullable=False)
+    # bumped on every write to the wishlist or its items, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # Indexes for find_by_customer_id, find_by_name and find_by_param. The
+    # version is left out of them so its bumps stay HOT updates
+    __table_args__ = (
+        db.Index("ix_wishlist_customer_id_name", "customer_id", "name"),
+        db.Index("ix_wishlist_name", "name"),
+    )
 
     items = db.relationship("Item", backref="wishlist", passive_deletes=True)
 
@@ -58,17 +279,32 @@ class Wishlist(db.Model):
         Updates a Wishlist to the database
         """
         logger.info("Saving %s", self.name)
+        Wishlist.touch(self.id)
         db.session.commit()
+        cache.invalidate(self.id)
 
     def delete(self):
         """Removes a Wishlist from the data store"""
         logger.info("Deleting wishlist %s", self.name)
+        wishlist_id = self.id
         db.session.delete(self)
         db.session.commit()
+        cache.invalidate(wishlist_id)
 
     def serialize(self):
         """Serializes a Wishlist into a dictionary"""
-        return {"id": self.id, "name": self.name, "customer_id": self.customer_id}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "customer_id": self.customer_id,
+            "version": self.version,
+        }
+
+    def serialize_with_items(self):
+        """Serializes a Wishlist and its already loaded items into a dictionary"""
+        data = self.serialize()
+        data["items"] = [item.serialize() for item in self.items]
+        return data
 
     def deserialize(self, data):
         """
@@ -110,9 +346,11 @@ class Wishlist(db.Model):
         logger.info("Initializing database")
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
+        pool.init_app(app)
         db.init_app(app)
+        cache.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        migrations.upgrade(db.engine)  # make our sqlalchemy tables
 
     @classmethod
     def all(cls):
@@ -126,6 +364,43 @@ class Wishlist(db.Model):
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_version(cls, wishlist_id: int) -> int:
+        """Returns the version of a Wishlist without loading it
+
+        :param wishlist_id: the id of the Wishlist
+        :type wishlist_id: int
+
+        :return: the version of the Wishlist, or None if not found
+        :rtype: int
+
+        """
+        logger.info("Processing version lookup for id %s ...", wishlist_id)
+        return db.session.query(cls.version).filter(cls.id == wishlist_id).scalar()
+
+    @classmethod
+    def touch(cls, *wishlist_ids) -> dict:
+        """Bumps the version of Wishlists in the current transaction
+
+        The caller commits, so the bump is atomic with its own writes. On
+        PostgreSQL the new versions come back from UPDATE ... RETURNING.
+
+        :return: the new version of each Wishlist by id, or None on
+            databases that cannot return them
+        :rtype: dict
+
+        """
+        stmt = (
+            update(cls)
+            .where(cls.id.in_(wishlist_ids))
+            .values(version=cls.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if db.engine.dialect.name != "postgresql":
+            db.session.execute(stmt)
+            return None
+        return dict(db.session.execute(stmt.returning(cls.id, cls.version)).all())
+
     @classmethod
     def find_or_404(cls, wishlist_id: int):
         """Find a Wishlist by it's id
@@ -150,17 +425,155 @@ class Wishlist(db.Model):
         logger.info("Processing query for %s ...", str(query))
 
         result = None
+        options = selectinload(cls.items)
 
         if query["name"] and query["customer_id"]:
-            result = cls.query.filter(
+            result = cls.query.options(options).filter(
                 cls.name == query["name"], cls.customer_id == query["customer_id"]
             )
         elif query["name"]:
-            result = cls.query.filter(cls.name == query["name"])
+            result = cls.query.options(options).filter(cls.name == query["name"])
         elif query["customer_id"]:
-            result = cls.query.filter(cls.customer_id == query["customer_id"])
+            result = cls.query.options(options).filter(
+                cls.customer_id == query["customer_id"]
+            )
         return result
 
+    @classmethod
+    def rename(cls, wishlist_id: int, customer_id: int, name: str) -> dict:
+        """Renames a Wishlist if it belongs to the customer
+
+        On PostgreSQL the ownership check and the update are one
+        UPDATE ... WHERE id = :id AND customer_id = :c RETURNING statement.
+
+        :param wishlist_id: the id of the Wishlist to rename
+        :type wishlist_id: int
+
+        :param customer_id: the customer_id that must own the Wishlist
+        :type customer_id: int
+
+        :param name: the new name of the Wishlist
+        :type name: str
+
+        :return: the serialized Wishlist, or None if the customer has no
+            Wishlist with that id
+        :rtype: dict
+
+        """
+        logger.info("Renaming wishlist %s of customer %s", wishlist_id, customer_id)
+        stmt = (
+            update(cls)
+            .where(cls.id == wishlist_id, cls.customer_id == customer_id)
+            .values(name=name, version=cls.version + 1)
+        )
+        if db.engine.dialect.name != "postgresql":
+            count = db.session.execute(stmt).rowcount
+            db.session.commit()
+            cache.invalidate(wishlist_id)
+            return cls.find(wishlist_id).serialize() if count else None
+
+        stmt = stmt.returning(cls.id, cls.name, cls.customer_id, cls.version)
+        row = db.session.execute(stmt).one_or_none()
+        db.session.commit()
+        cache.invalidate(wishlist_id)
+        return dict(row._mapping) if row else None
+
+    @classmethod
+    def find_page(cls, query: dict, cursor: int = None, limit: int = 100) -> list:
+        """Returns a page of Wishlists, with their items, ordered by id
+
+        Uses keyset pagination (id > cursor ORDER BY id LIMIT n) so every page
+        is an index range scan on the primary key, however deep it is.
+
+        :param query: optional "name" and "customer_id" filters
+        :type query: dict
+
+        :param cursor: the id of the last Wishlist of the previous page
+        :type cursor: int
+
+        :param limit: the maximum number of Wishlists to return
+        :type limit: int
+
+        :return: at most <limit> Wishlists with an id greater than <cursor>
+        :rtype: list
+
+        """
+        logger.info("Processing page query for %s after %s ...", str(query), cursor)
+        result = cls.query.options(selectinload(cls.items))
+        if query.get("name"):
+            result = result.filter(cls.name == query["name"])
+        if query.get("customer_id") is not None:
+            result = result.filter(cls.customer_id == query["customer_id"])
+        if cursor is not None:
+            result = result.filter(cls.id > cursor)
+        return result.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def stream(cls, customer_id: int = None, batch_size: int = 1000):
+        """Yields every Wishlist serialized with its items, in id order
+
+        Wishlists and items are read by one LEFT JOIN through a server-side
+        cursor that fetches batch_size rows at a time, so memory stays
+        constant however large the tables are.
+
+        :param customer_id: only yield the Wishlists of this customer
+        :type customer_id: int
+
+        :param batch_size: the number of rows fetched from the cursor at a time
+        :type batch_size: int
+
+        """
+        logger.info("Processing export for customer_id %s ...", customer_id)
+        wishlist = cls.__table__
+        item = Item.__table__
+        stmt = (
+            select(
+                wishlist.c.id,
+                wishlist.c.name,
+                wishlist.c.customer_id,
+                wishlist.c.version,
+                item.c.id.label("item_id"),
+                item.c.product_id,
+                item.c.product_name,
+                item.c.product_price,
+            )
+            .select_from(wishlist.outerjoin(item))
+            .order_by(wishlist.c.id, item.c.id)
+        )
+        if customer_id is not None:
+            stmt = stmt.where(wishlist.c.customer_id == customer_id)
+
+        result = db.session.execute(
+            stmt.execution_options(stream_results=True, max_row_buffer=batch_size)
+        )
+        try:
+            current = None
+            for row in result:
+                if current is None or current["id"] != row.id:
+                    if current is not None:
+                        yield current
+                    current = {
+                        "id": row.id,
+                        "name": row.name,
+                        "customer_id": row.customer_id,
+                        "version": row.version,
+                        "items": [],
+                    }
+                if row.item_id is not None:
+                    current["items"].append(
+                        {
+                            "id": row.item_id,
+                            "wishlist_id": row.id,
+                            "product_id": row.product_id,
+                            "product_name": row.product_name,
+                            "product_price": row.product_price,
+                        }
+                    )
+            if current is not None:
+                yield current
+        finally:
+            result.close()
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Wishlists with the given name
@@ -202,6 +615,14 @@ class Item(db.Model):
     product_name = db.Column(db.String(63), nullable=False)
     product_price = db.Column(db.Numeric, nullable=False)
 
+    # A product can only be in a wishlist once. The constraint's index also
+    # serves find_by_wishlist_id and find_by_wishlist_id_and_product_id
+    __table_args__ = (
+        db.UniqueConstraint(
+            "wishlist_id", "product_id", name="uq_item_wishlist_id_product_id"
+        ),
+    )
+
     def __repr__(self):
         return (
             "<Item id=[%s] wishlist_id=[%s] product_id=[%s] product_name = [%s] product_price=[%s]>"
@@ -227,11 +648,29 @@ class Item(db.Model):
         )
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
+        Wishlist.touch(self.wishlist_id)
         db.session.commit()
+        cache.invalidate(self.wishlist_id)
+
+    def create_or_get(self):
+        """
+        Adds a Wishlist item to the database unless its product is already
+        in the wishlist, in which case this item is loaded from the existing row
+
+        :return: True if the item was created, False if it already existed,
+            or None if the wishlist does not exist
+        :rtype: bool
 
-    def update(self):
+        """
+        results = Item.create_or_get_all([self])
+        return None if results is None else results[0]
+
+    def update(self) -> bool:
         """
         Updates a Wishlist item to the database
+
+        Returns False, and changes nothing, if the item would repeat a
+        product that is already in its wishlist
         """
         logger.info(
             "Creating wishlist_id=[%s] product_id=[%s] product_name = [%s] product_price=[%s]",
@@ -240,13 +679,24 @@ class Item(db.Model):
             self.product_name,
             self.product_price,
         )
-        db.session.commit()
+        try:
+            Wishlist.touch(self.wishlist_id)
+            db.session.commit()
+        except IntegrityError:
+            # the only constraint an update can break is the unique product
+            db.session.rollback()
+            return False
+        cache.invalidate(self.wishlist_id)
+        return True
 
     def delete(self):
         """Removes a Wishlist item from the data store"""
         logger.info("Deleting item %s", self.id)
+        wishlist_id = self.wishlist_id
         db.session.delete(self)
+        Wishlist.touch(wishlist_id)
         db.session.commit()
+        cache.invalidate(wishlist_id)
 
     def serialize(self):
         """Serializes a Wishlist into a dictionary"""
@@ -285,9 +735,142 @@ class Item(db.Model):
         logger.info("Initializing database")
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
+        pool.init_app(app)
         db.init_app(app)
+        cache.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our SQLAlchemy tables
+        migrations.upgrade(db.engine)  # make our SQLAlchemy tables
+
+    @classmethod
+    def create_or_get_all(cls, items: list) -> list:
+        """Adds Wishlist items to the database in one transaction
+
+        On PostgreSQL all the items are written by a single multi-row
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement, so the
+        existence checks and the inserts are atomic and concurrent adds of the
+        same product cannot create duplicates. Items whose product is already
+        in the wishlist are loaded from the existing row.
+
+        :param items: the Items to add
+        :type items: list
+
+        :return: True for each item that was created and False for each one
+            that already existed, or None if a wishlist does not exist
+        :rtype: list
+
+        """
+        logger.info("Creating or getting %d wishlist items", len(items))
+        if not items:
+            return []
+        if db.engine.dialect.name != "postgresql":
+            return cls._create_or_get_all_fallback(items)
+
+        # ON CONFLICT cannot touch the same row twice, so the first item for
+        # each product is written and later ones report it as existing
+        values = {}
+        for item in items:
+            values.setdefault(
+                (item.wishlist_id, item.product_id),
+                {
+                    "wishlist_id": item.wishlist_id,
+                    "product_id": item.product_id,
+                    "product_name": item.product_name,
+                    "product_price": item.product_price,
+                },
+            )
+
+        table = cls.__table__
+        stmt = postgresql.insert(table).values(list(values.values()))
+        # the no-op update makes RETURNING produce the existing row on conflict
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_item_wishlist_id_product_id",
+            set_={"product_id": stmt.excluded.product_id},
+        ).returning(
+            table.c.id,
+            table.c.wishlist_id,
+            table.c.product_id,
+            table.c.product_name,
+            table.c.product_price,
+            literal_column("xmax = 0").label("inserted"),
+        )
+        try:
+            rows = db.session.execute(stmt).all()
+            if any(row.inserted for row in rows):
+                Wishlist.touch(*{row.wishlist_id for row in rows if row.inserted})
+            db.session.commit()
+        except IntegrityError:
+            # the only remaining constraint is the foreign key to the wishlist
+            db.session.rollback()
+            return None
+        cache.invalidate(*{item.wishlist_id for item in items})
+
+        rows = {(row.wishlist_id, row.product_id): row for row in rows}
+        created = []
+        for item in items:
+            key = (item.wishlist_id, item.product_id)
+            row = rows[key]
+            item.id = row.id
+            item.product_name = row.product_name
+            item.product_price = row.product_price
+            created.append(row.inserted and key in values)
+            values.pop(key, None)
+        return created
+
+    @classmethod
+    def _create_or_get_all_fallback(cls, items: list) -> list:
+        """Adds Wishlist items one by one on databases without ON CONFLICT"""
+        for wishlist_id in {item.wishlist_id for item in items}:
+            if not Wishlist.find(wishlist_id):
+                return None
+        created = []
+        for item in items:
+            existing = cls.find_by_wishlist_id_and_product_id(
+                item.wishlist_id, item.product_id
+            ).first()
+            if existing:
+                item.id = existing.id
+                item.product_name = existing.product_name
+                item.product_price = existing.product_price
+                created.append(False)
+            else:
+                item.id = None  # id must be none to generate next primary key
+                db.session.add(item)
+                db.session.flush()
+                created.append(True)
+        if any(created):
+            Wishlist.touch(
+                *{item.wishlist_id for item, new in zip(items, created) if new}
+            )
+        db.session.commit()
+        cache.invalidate(*{item.wishlist_id for item in items})
+        return created
+
+    @classmethod
+    def delete_by_wishlist_id(cls, wishlist_id: int) -> tuple:
+        """Removes all of the items of a Wishlist with one DELETE statement
+
+        :param wishlist_id: the wishlist_id of the Wishlist to clear
+        :type wishlist_id: int
+
+        :return: the number of items removed, and the new version of the
+            Wishlist or None if no item was removed
+        :rtype: tuple
+
+        """
+        logger.info("Deleting all items of wishlist %s", wishlist_id)
+        count = cls.query.filter(cls.wishlist_id == wishlist_id).delete(
+            synchronize_session=False
+        )
+        version = None
+        if count:
+            versions = Wishlist.touch(wishlist_id)
+            if versions is None:
+                version = Wishlist.find_version(wishlist_id)
+            else:
+                version = versions.get(wishlist_id)
+        db.session.commit()
+        cache.invalidate(wishlist_id)
+        return count, version
 
     @classmethod
     def find_by_wishlist_id_and_product_id(
@@ -5,15 +5,22 @@ Paths:
 ------
 POST /wishlists - creates a new Wishlist record in the database
 """
-
-from flask import jsonify, request, abort, make_response
-from flask_restx import Resource, fields, reqparse
+import logging
+from flask import jsonify, request, abort, make_response, Response
+from flask import stream_with_context
+from flask_restx import Resource, fields, reqparse, inputs
+from werkzeug.http import quote_etag
 from service.utils import status  # HTTP Status Codes
-from service.models import Wishlist, Item
+from service.utils.pool import pool_stats
+from service.utils.health import DatabaseCheck
+from service.utils.serializers import marshal, marshal_with, marshal_list_with, dumps
+from service.models import db, Wishlist, Item, cache
 
 # Import Flask application
 from . import app, api
 
+logger = logging.getLogger(__name__)
+
 
 ############################################################
 # Health Endpoint
@@ -24,13 +31,52 @@ def health():
     return jsonify(dict(status="OK")), status.HTTP_200_OK
 
 
+database_check = DatabaseCheck(lambda: db.engine, app.config["HEALTH_CHECK_TIMEOUT"])
+
+
+@app.route("/health/live")
+def liveness():
+    """Liveness probe, the process is up and serving requests"""
+    return jsonify(dict(status="OK")), status.HTTP_200_OK
+
+
+@app.route("/health/ready")
+def readiness():
+    """Readiness probe, the database can be queried"""
+    error = database_check.check(app.config["HEALTH_CHECK_TTL"])
+    if error:
+        return (
+            jsonify(dict(status="UNAVAILABLE", database=error)),
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return jsonify(dict(status="OK", database="OK")), status.HTTP_200_OK
+
+
+############################################################
+# Cache Statistics Endpoint
+############################################################
+@app.route("/admin/cache")
+def cache_stats():
+    """Wishlist cache hit and miss counters"""
+    return jsonify(cache.stats()), status.HTTP_200_OK
+
+
+############################################################
+# Connection Pool Statistics Endpoint
+############################################################
+@app.route("/admin/pool")
+def connection_pool_stats():
+    """Database connection pool usage and checkout wait times"""
+    return jsonify(pool_stats(db.engine.pool)), status.HTTP_200_OK
+
+
 ######################################################################
 # GET INDEX VIEW
 ######################################################################
 @app.route("/")
 def index():
     """Root URL response"""
-    app.logger.info("Request for Root URL")
+    logger.info("Request for Root URL")
     return app.send_static_file("index.html")
 
 
@@ -40,7 +86,7 @@ def index():
 @app.route("/wishlists/<int:wishlist_id>")
 def wishlist_index(wishlist_id):
     """Root URL response"""
-    app.logger.info("Request for wishlist %s view", wishlist_id)
+    logger.info("Request for wishlist %s view", wishlist_id)
 
     wishlist = Wishlist.find(wishlist_id)
     if not wishlist:
@@ -78,6 +124,17 @@ item_model = api.inherit(
     },
 )
 
+batch_item_model = api.inherit(
+    "BatchItemModel",
+    item_model,
+    {
+        "status": fields.String(
+            readOnly=True,
+            description="Whether the item was 'created' or already 'existing'",
+        ),
+    },
+)
+
 # Define the model so that the docs reflect what can be sent
 create_wishlist = api.model(
     "CreateWishlist",
@@ -96,6 +153,10 @@ wishlist_model = api.inherit(
         "id": fields.Integer(
             readOnly=True, description="The unique id assigned internally by service"
         ),
+        "version": fields.Integer(
+            readOnly=True,
+            description="Bumped on every change to the Wishlist or its items",
+        ),
         "items": fields.List(
             fields.Nested(
                 item_model,
@@ -106,6 +167,27 @@ wishlist_model = api.inherit(
     },
 )
 
+clear_wishlist_model = api.inherit(
+    "ClearWishlistModel",
+    wishlist_model,
+    {
+        "items_removed": fields.Integer(
+            readOnly=True, description="The number of items removed by the clear"
+        ),
+    },
+)
+
+# the fields mask header, documented the way @api.marshal_with does it for
+# the endpoints that call marshal() themselves
+mask_params = {
+    app.config["RESTX_MASK_HEADER"]: {
+        "in": "header",
+        "type": "string",
+        "format": "mask",
+        "description": "An optional fields mask",
+    }
+}
+
 # query string arguments
 wishlist_args = reqparse.RequestParser()
 wishlist_args.add_argument(
@@ -118,6 +200,41 @@ wishlist_args.add_argument(
     help="List Wishlist by customer id",
     location="args",
 )
+wishlist_args.add_argument(
+    "limit",
+    type=inputs.positive,
+    required=False,
+    help="Maximum number of Wishlists per page",
+    location="args",
+)
+wishlist_args.add_argument(
+    "cursor",
+    type=inputs.natural,
+    required=False,
+    help="Id of the last Wishlist of the previous page",
+    location="args",
+)
+
+# query string arguments of the wishlist update
+update_args = reqparse.RequestParser()
+update_args.add_argument(
+    "items",
+    type=inputs.boolean,
+    required=False,
+    default=False,
+    help="Include the Wishlist items in the response",
+    location="args",
+)
+
+# query string arguments of the export
+export_args = reqparse.RequestParser()
+export_args.add_argument(
+    "customer_id",
+    type=int,
+    required=False,
+    help="Export the Wishlists of a customer id",
+    location="args",
+)
 
 
 ######################################################################
@@ -138,32 +255,39 @@ class WishlistResource(Resource):
     # ---------------------------------------------------------------------
     # RETRIEVE A WISHLIST
     # ---------------------------------------------------------------------
-    @api.doc("get_wishlists")
+    @api.doc("get_wishlists", params=mask_params)
     @api.response(404, "Wishlist not found")
-    @api.marshal_with(wishlist_model)
+    @api.response(304, "Wishlist not modified")
+    @api.response(200, "Success", wishlist_model)
     def get(self, wishlist_id):
         """
         Retrieve a single Wishlist
 
-        This endpoint will return a Wishlist based on it's id
+        This endpoint will return a Wishlist based on it's id.
+        It answers If-None-Match with 304 when the Wishlist is unchanged
         """
-        app.logger.info("Request for wishlist with id: %s", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
-        if not wishlist:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Wishlist with id '{wishlist_id}' was not found.",
-            )
-
-        app.logger.info("Returning wishlist: %s", wishlist.name)
-
-        response = wishlist.serialize()
-
-        response["items"] = [
-            item.serialize() for item in Item.find_by_wishlist_id(wishlist_id)
-        ]
-
-        return response, status.HTTP_200_OK
+        logger.info("Request for wishlist with id: %s", wishlist_id)
+        not_found = f"Wishlist with id '{wishlist_id}' was not found."
+        if request.if_none_match or cache.ttl > 0:
+            # one lookup of the version serves both If-None-Match and the cache
+            version = Wishlist.find_version(wishlist_id)
+            if version is None:
+                abort(status.HTTP_404_NOT_FOUND, not_found)
+            not_modified = check_not_modified(wishlist_id, version)
+            if not_modified:
+                return not_modified
+            response = cache.get_wishlist(wishlist_id, version)
+        else:
+            response = cache.get_wishlist(wishlist_id)
+        if not response:
+            abort(status.HTTP_404_NOT_FOUND, not_found)
+
+        logger.info("Returning wishlist: %s", response["name"])
+        return (
+            marshal(response, wishlist_model),
+            status.HTTP_200_OK,
+            {"ETag": wishlist_etag(wishlist_id, response["version"])},
+        )
 
     # ---------------------------------------------------------------------
     # UPDATE WISHLIST NAME
@@ -171,51 +295,35 @@ class WishlistResource(Resource):
     @api.doc("update_wishlists")
     @api.response(404, "Wishlist not found")
     @api.response(400, "The posted wishlist data was not valid")
-    @api.expect(create_wishlist, validate=True)
-    @api.marshal_with(wishlist_model)
+    @api.expect(update_args, create_wishlist, validate=True)
+    @marshal_with(wishlist_model, skip_none=True)
     def put(self, wishlist_id):
         """
         Updates a Wishlist name
-        This endpoint will update a Wishlist name based on the data in the body
+        This endpoint will update a Wishlist name based on the data in the body.
+        The Wishlist items are only returned when items=true is passed
         """
 
-        app.logger.info("Request to update a wishlist")
+        logger.info("Request to update a wishlist")
         check_content_type("application/json")
+        args = update_args.parse_args()
 
         req = api.payload
-
-        # TODO : validate param
         customer_id = req["customer_id"]
 
-        wishlists = []
-        app.logger.info("Request for wishlists with customer id: %s", customer_id)
-
-        wishlists = Wishlist.find_by_customer_id(customer_id)
-
-        results = [wishlist.serialize() for wishlist in wishlists]
-
-        if len(results) == 0:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Wishlist with customer id '{customer_id}' was not found.",
-            )
-
-        if not any(wishlist["id"] == wishlist_id for wishlist in results):
+        message = Wishlist.rename(wishlist_id, customer_id, req["name"])
+        if not message:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist with customer id '{customer_id}' and id '{wishlist_id}' was not found.",
             )
 
-        wishlist = Wishlist.find(wishlist_id)
-        req = api.payload
-        wishlist.name = req["name"]
-        wishlist.update()
-
-        message = wishlist.serialize()
-
-        message["items"] = [
-            item.serialize() for item in Item.find_by_wishlist_id(wishlist_id)
-        ]
+        # items are left out of the response unless they were asked for
+        message["items"] = None
+        if args["items"]:
+            message["items"] = [
+                item.serialize() for item in Item.find_by_wishlist_id(wishlist_id)
+            ]
 
         return message, status.HTTP_200_OK
 
@@ -230,12 +338,12 @@ class WishlistResource(Resource):
 
         This endpoint will delete a Wishlist based the id specified in the path
         """
-        app.logger.info("Request to delete wishlist with id: %s", wishlist_id)
+        logger.info("Request to delete wishlist with id: %s", wishlist_id)
         wishlist = Wishlist.find(wishlist_id)
         if wishlist:
             wishlist.delete()
 
-        app.logger.info("Wishlist with ID [%s] delete complete.", wishlist_id)
+        logger.info("Wishlist with ID [%s] delete complete.", wishlist_id)
         return "", status.HTTP_204_NO_CONTENT
 
 
@@ -251,38 +359,44 @@ class WishlistCollection(Resource):
     # ---------------------------------------------------------------------
     @api.doc("list_wishlists")
     @api.expect(wishlist_args, validate=True)
-    @api.marshal_list_with(wishlist_model)
+    @marshal_list_with(wishlist_model)
     def get(self):
-        """Returns all of the Wishlists"""
-        app.logger.info("Request for the list of wishlists")
-        wishlists = []
+        """
+        Returns a page of the Wishlists
 
-        # print(request.args.keys())
+        Wishlists are ordered by id. When there are more results a Link
+        header with rel="next" points at the following page.
+        """
+        logger.info("Request for the list of wishlists")
         args = wishlist_args.parse_args()
 
-        # name = request.args.get("name", None)
-        # customer_id = request.args.get("customer_id", None)
-
         query = {"name": args["name"], "customer_id": args["customer_id"]}
+        limit = min(
+            args["limit"] or app.config["WISHLIST_PAGE_SIZE"],
+            app.config["WISHLIST_PAGE_SIZE_MAX"],
+        )
 
-        if args["name"] or args["customer_id"]:
-            wishlists = Wishlist.find_by_param(query)
-        else:
-            wishlists = Wishlist.all()
+        # ask for one extra row to know if there is a next page
+        wishlists = Wishlist.find_page(query, args["cursor"], limit + 1)
+
+        headers = {}
+        if len(wishlists) > limit:
+            wishlists = wishlists[:limit]
+            filters = {key: value for key, value in query.items() if value is not None}
+            next_url = api.url_for(
+                WishlistCollection,
+                cursor=wishlists[-1].id,
+                limit=limit,
+                _external=True,
+                **filters,
+            )
+            headers["Link"] = f'<{next_url}>; rel="next"'
 
-        results = []
-        if wishlists is not None:
-            wishlist_results = [wishlist.serialize() for wishlist in wishlists]
-            for wishlist in wishlist_results:
-                wishlist["items"] = [
-                    item.serialize()
-                    for item in Item.find_by_wishlist_id(wishlist["id"])
-                ]
-                results.append(wishlist)
-        app.logger.info("Returning %d wishlists", len(results))
-
-        # print(results)
-        return results, status.HTTP_200_OK
+        # items are eager loaded with the wishlists, so no query per wishlist
+        results = [wishlist.serialize_with_items() for wishlist in wishlists]
+        logger.info("Returning %d wishlists", len(results))
+
+        return results, status.HTTP_200_OK, headers
 
     # ---------------------------------------------------------------------
     # ADD A NEW WISHLIST
@@ -290,13 +404,13 @@ class WishlistCollection(Resource):
     @api.doc("create_wishlists")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_wishlist, validate=True)
-    @api.marshal_with(wishlist_model, code=201)
+    @marshal_with(wishlist_model, code=201)
     def post(self):
         """
         Creates a Wishlist
         This endpoint will create a Wishlist based the data in the body that is posted
         """
-        app.logger.info("Request to create a wishlist")
+        logger.info("Request to create a wishlist")
         check_content_type("application/json")
         wishlist = Wishlist()
         wishlist.deserialize(api.payload)
@@ -307,10 +421,42 @@ class WishlistCollection(Resource):
             WishlistResource, wishlist_id=wishlist.id, _external=True
         )
 
-        app.logger.info("Wishlist with ID [%s] created.", wishlist.id)
+        logger.info("Wishlist with ID [%s] created.", wishlist.id)
         return message, status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /wishlists/export
+######################################################################
+@api.route("/wishlists/export")
+class WishlistExport(Resource):
+    """Streams every Wishlist with its items"""
+
+    @api.doc("export_wishlists")
+    @api.expect(export_args, validate=True)
+    @api.produces(["application/x-ndjson"])
+    @api.response(200, "One Wishlist with its items per line", wishlist_model)
+    def get(self):
+        """
+        Exports all of the Wishlists as newline-delimited JSON
+
+        The Wishlists are streamed from a server-side cursor, so the
+        response can be as large as the tables without using more memory
+        """
+        logger.info("Request to export wishlists")
+        args = export_args.parse_args()
+
+        def generate():
+            for wishlist in Wishlist.stream(args["customer_id"]):
+                yield dumps(wishlist) + b"\n"
+
+        return Response(
+            stream_with_context(generate()),
+            status=status.HTTP_200_OK,
+            mimetype="application/x-ndjson",
+        )
+
+
 ######################################################################
 #  PATH: /wishlists/{id}/clear
 ######################################################################
@@ -321,14 +467,14 @@ class ClearResource(Resource):
 
     @api.doc("clear_wishlist")
     @api.response(404, "Wishlist not found")
-    @api.marshal_with(wishlist_model, code=200)
+    @marshal_with(clear_wishlist_model, code=200)
     def put(self, wishlist_id):
         """
         Clear a Wishlist
 
         This endpoint will clear a Wishlist based the id specified in the path
         """
-        app.logger.info("Request to clear wishlist with id: %s", wishlist_id)
+        logger.info("Request to clear wishlist with id: %s", wishlist_id)
         wishlist = Wishlist.find(wishlist_id)
         if not wishlist:
             abort(
@@ -336,17 +482,20 @@ class ClearResource(Resource):
                 f"Wishlist with id '{wishlist_id}' was not found.",
             )
 
-        items = Item.find_by_wishlist_id(wishlist_id)
-
-        for item in items:
-            item.delete()
-
+        # serialize before the commit expires the wishlist, and take the
+        # bumped version from the clear rather than reading the row again
         response = wishlist.serialize()
-
-        response["items"] = [
-            item.serialize() for item in Item.find_by_wishlist_id(wishlist_id)
-        ]
-
+        removed, version = Item.delete_by_wishlist_id(wishlist_id)
+        if version is not None:
+            response["version"] = version
+        response["items"] = []
+        response["items_removed"] = removed
+
+        logger.info(
+            "Removed %d items from wishlist [%s]",
+            response["items_removed"],
+            wishlist_id,
+        )
         return response, status.HTTP_200_OK
 
 
@@ -360,28 +509,38 @@ class WishlistItemsCollection(Resource):
     # ---------------------------------------------------------------------
     # RETRIEVE A WISHLIST'S ITEMS
     # ---------------------------------------------------------------------
-    @api.doc("list_wishlists_items")
+    @api.doc("list_wishlists_items", params=mask_params)
     @api.response(404, "Wishlist not found")
-    @api.marshal_list_with(item_model)
+    @api.response(304, "Wishlist not modified")
+    @api.response(200, "Success", [item_model])
     def get(self, wishlist_id):
         """
         Retrieve a Wishlist's items
 
-        This endpoint will return a Wishlist's items based on it's id
+        This endpoint will return a Wishlist's items based on it's id.
+        It answers If-None-Match with 304 when the Wishlist is unchanged
         """
-        app.logger.info("Request for wishlist items with wishlist_id: %s", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
-        if not wishlist:
+        logger.info("Request for wishlist items with wishlist_id: %s", wishlist_id)
+        version = Wishlist.find_version(wishlist_id)
+        if version is None:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist with id '{wishlist_id}' was not found.",
             )
 
-        app.logger.info("Returning wishlist: %s", wishlist.name)
+        etag = wishlist_etag(wishlist_id, version)
+        if request.if_none_match.contains_raw(etag):
+            return not_modified_response(etag)
+
+        logger.info("Returning items of wishlist: %s", wishlist_id)
 
         response = [item.serialize() for item in Item.find_by_wishlist_id(wishlist_id)]
 
-        return response, status.HTTP_200_OK
+        return (
+            marshal(response, item_model),
+            status.HTTP_200_OK,
+            {"ETag": etag},
+        )
 
     # ---------------------------------------------------------------------
     # CREATE WISHLIST ITEM
@@ -389,14 +548,14 @@ class WishlistItemsCollection(Resource):
     @api.doc("create_wishlist_items")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_item, validate=True)
-    @api.marshal_with(item_model, code=201)
+    @marshal_with(item_model, code=201)
     def post(self, wishlist_id):
         """
         Updates a Wishlist, adds products
         This endpoint will add a new product to a wishlist
         """
 
-        app.logger.info("Request to create a wishlist item")
+        logger.info("Request to create a wishlist item")
         check_content_type("application/json")
 
         req = api.payload
@@ -405,29 +564,88 @@ class WishlistItemsCollection(Resource):
         item = Item()
         item.deserialize(req)
 
-        # check for existence
-        Wishlist.find_or_404(wishlist_id)
-
-        items = Item.find_by_wishlist_id_and_product_id(wishlist_id, item.product_id)
-        results = [item.serialize() for item in items]
+        created = item.create_or_get()
+        if created is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist with id '{wishlist_id}' was not found.",
+            )
 
-        if len(results) != 0:
+        message = item.serialize()
+        if not created:
             # already exists, so return same object
-            message = results[0]
             return message, status.HTTP_200_OK
 
-        item.create()
-        message = item.serialize()
-
         location_url = api.url_for(
             WishlistItemsCollection, wishlist_id=item.id, _external=True
         )
 
-        app.logger.info("Wishlist item with ID [%s] created.", item.id)
+        logger.info("Wishlist item with ID [%s] created.", item.id)
 
         return message, status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /wishlists/{id}/items:batch
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/items:batch")
+@api.param("wishlist_id", "The Wishlist identifier")
+class WishlistItemsBatch(Resource):
+    """Handles adding many Items to a wishlist at once"""
+
+    # ---------------------------------------------------------------------
+    # CREATE WISHLIST ITEMS IN BULK
+    # ---------------------------------------------------------------------
+    @api.doc("create_wishlist_items_batch")
+    @api.response(400, "The posted data was not valid")
+    @api.response(404, "Wishlist not found")
+    @api.expect([create_item], validate=True)
+    @marshal_list_with(batch_item_model)
+    def post(self, wishlist_id):
+        """
+        Adds many products to a Wishlist
+        This endpoint will add all of the posted products in one transaction
+        and report for each one whether it was created or already existing
+        """
+        logger.info("Request to create wishlist items in bulk")
+        check_content_type("application/json")
+
+        req = api.payload
+        if not isinstance(req, list):
+            abort(status.HTTP_400_BAD_REQUEST, "The items must be posted as an array.")
+        if len(req) > app.config["ITEM_BATCH_SIZE_MAX"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"No more than {app.config['ITEM_BATCH_SIZE_MAX']} items per batch.",
+            )
+
+        items = []
+        for data in req:
+            data["wishlist_id"] = wishlist_id
+            items.append(Item().deserialize(data))
+
+        created = Item.create_or_get_all(items)
+        if created is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist with id '{wishlist_id}' was not found.",
+            )
+
+        results = []
+        for item, was_created in zip(items, created):
+            message = item.serialize()
+            message["status"] = "created" if was_created else "existing"
+            results.append(message)
+
+        logger.info(
+            "Added %d of %d items to wishlist [%s]",
+            created.count(True),
+            len(items),
+            wishlist_id,
+        )
+        return results, status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /wishlists/{id}/items/{id}
 ######################################################################
@@ -440,14 +658,14 @@ class WishlistItemResource(Resource):
     # ---------------------------------------------------------------------
     @api.doc("get_wishlists_item_by_id")
     @api.response(404, "Item not found")
-    @api.marshal_with(item_model)
+    @marshal_with(item_model)
     def get(self, wishlist_id, item_id):
         """
         Retrieve a Wishlist's items
 
         This endpoint will return a Wishlist's items based on it's id
         """
-        app.logger.info("Request for wishlist items with wishlist_id: %s", wishlist_id)
+        logger.info("Request for wishlist items with wishlist_id: %s", wishlist_id)
         wishlist = Wishlist.find(wishlist_id)
         if not wishlist:
             abort(
@@ -455,7 +673,7 @@ class WishlistItemResource(Resource):
                 f"Wishlist with id '{wishlist_id}' was not found.",
             )
 
-        app.logger.info("Returning wishlist: %s", wishlist.name)
+        logger.info("Returning wishlist: %s", wishlist.name)
 
         response = [
             item.serialize()
@@ -475,21 +693,22 @@ class WishlistItemResource(Resource):
     # ---------------------------------------------------------------------
     @api.doc("update_wishlist_items")
     @api.response(404, "Item not found")
+    @api.response(409, "The product is already in the Wishlist")
     @api.response(400, "The posted Item data was not valid")
     @api.expect(create_item, validate=True)
-    @api.marshal_with(item_model)
+    @marshal_with(item_model)
     def put(self, wishlist_id, item_id):
         """
         Updates a wishlist item
         """
 
-        app.logger.info("Request to update a wishlist item")
+        logger.info("Request to update a wishlist item")
         check_content_type("application/json")
 
         req = api.payload
         req["wishlist_id"] = wishlist_id
 
-        app.logger.info(
+        logger.info(
             "Request for wishlists with wishlist_id id: %s and item_id: %s",
             wishlist_id,
             item_id,
@@ -506,7 +725,11 @@ class WishlistItemResource(Resource):
 
         if len(results) > 0:
             item = results[0]
-            item.update()
+            if not item.update():
+                abort(
+                    status.HTTP_409_CONFLICT,
+                    f"Product {req['product_id']} is already in wishlist {wishlist_id}",
+                )
 
             message = item.serialize()
 
@@ -528,7 +751,7 @@ class WishlistItemResource(Resource):
         Delete a Wishlist Item
         This endpoint will delete a Product based on the product id
         """
-        app.logger.info(
+        logger.info(
             "Request to delete Product %s for Wishlist id: %s", item_id, wishlist_id
         )
 
@@ -544,10 +767,30 @@ class WishlistItemResource(Resource):
 ######################################################################
 
 
-def init_db():
-    """Initializes the SQLAlchemy app"""
-    global app
-    Wishlist.init_db(app)
+def wishlist_etag(wishlist_id, version):
+    """Returns the weak ETag of a Wishlist version"""
+    return quote_etag(f"{wishlist_id}-{version}", weak=True)
+
+
+def not_modified_response(etag):
+    """Returns an empty 304 Not Modified response carrying the ETag"""
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.headers["ETag"] = etag
+    return response
+
+
+def check_not_modified(wishlist_id, version):
+    """Returns a 304 response if the request's If-None-Match is current
+
+    Only the Wishlist version is needed, so a matching client costs a
+    single primary key lookup and the items are never loaded.
+    """
+    if not request.if_none_match:
+        return None
+    etag = wishlist_etag(wishlist_id, version)
+    if request.if_none_match.contains_raw(etag):
+        return not_modified_response(etag)
+    return None
 
 
 def check_content_type(media_type):
@@ -555,7 +798,7 @@ def check_content_type(media_type):
     content_type = request.headers.get("Content-Type")
     if content_type and content_type == media_type:
         return
-    app.logger.error("Invalid Content-Type: %s", content_type)
+    logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         "Content-Type must be {}".format(media_type),
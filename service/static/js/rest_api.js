@@ -39,6 +39,34 @@ $(function () {
         $("#flash_message").append(message);
     }
 
+    // Returns the URL of the rel="next" link in a Link header, if any
+    function next_link(header) {
+        let match = /<([^>]*)>;\s*rel="next"/.exec(header || "");
+        return match ? match[1] : null;
+    }
+
+    // Gets every page of a list, following the Link headers
+    function get_all_pages(url, results, done, fail) {
+        let ajax = $.ajax({
+            type: "GET",
+            url: url,
+            contentType: "application/json",
+            data: ''
+        })
+
+        ajax.done(function(res, textStatus, xhr){
+            results = results.concat(res);
+            let next = next_link(xhr.getResponseHeader("Link"));
+            if (next) {
+                get_all_pages(next, results, done, fail);
+            } else {
+                done(results);
+            }
+        });
+
+        ajax.fail(fail);
+    }
+
     // ****************************************
     // Create a Wishlist
     // ****************************************
@@ -381,14 +409,7 @@ $(function () {
 
         $("#flash_message").empty();
 
-        let ajax = $.ajax({
-            type: "GET",
-            url: `/api/wishlists?${queryString}`,
-            contentType: "application/json",
-            data: ''
-        })
-
-        ajax.done(function(res){
+        get_all_pages(`/api/wishlists?${queryString}`, [], function(res){
             //alert(res.toSource())
             $("#search_results").empty();
             let table = '<table class="table table-striped" cellpadding="10">'
@@ -415,9 +436,7 @@ $(function () {
             }
 
             flash_message("Success")
-        });
-
-        ajax.fail(function(res){
+        }, function(res){
             flash_message(res.responseJSON.message)
         });
 
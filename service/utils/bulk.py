@@ -0,0 +1,341 @@
+"""
+Bulk Import and Export
+
+This module loads wishlists and items in bulk for the import-wishlists
+command. Rows are written in batches with COPY FROM STDIN on PostgreSQL
+and with multi-row INSERTs on other databases, such as SQLite, inside a
+single transaction. New wishlist ids are reserved from the database up
+front, so the items of the input can be remapped to them.
+
+It also dumps them for the export-wishlists command, with COPY TO STDOUT
+on PostgreSQL and a server-side cursor elsewhere, so memory stays
+constant however large the tables are.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from itertools import islice
+from sqlalchemy import func, select, text
+from service.models import db, Wishlist, Item, DataValidationError
+
+WISHLIST_COLUMNS = ("id", "name", "customer_id")
+ITEM_COLUMNS = ("wishlist_id", "product_id", "product_name", "product_price")
+
+
+def read_ndjson(file):
+    """Yields one wishlist dict, with its items, per line of the file"""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(file):
+    """Yields one dict per row of a CSV file with a header"""
+    yield from csv.DictReader(file)
+
+
+def batched(iterable, size):
+    """Yields lists of up to size entries of iterable"""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+class BulkWriter:
+    """Writes batches of rows on one connection, in one transaction"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.postgres = connection.dialect.name == "postgresql"
+        self._next_id = {}
+
+    def reserve_ids(self, table, count: int) -> list:
+        """Reserves count new primary keys of a table"""
+        if self.postgres:
+            rows = self.connection.execute(
+                text(
+                    "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                    "FROM generate_series(1, :count)"
+                ),
+                {"table": table.name, "count": count},
+            )
+            return [row[0] for row in rows]
+        # other databases have a single writer, so count up from the max id
+        if table.name not in self._next_id:
+            max_id = self.connection.execute(select(func.max(table.c.id))).scalar()
+            self._next_id[table.name] = (max_id or 0) + 1
+        start = self._next_id[table.name]
+        self._next_id[table.name] += count
+        return list(range(start, start + count))
+
+    def write(self, table, columns, rows):
+        """Writes rows, tuples of the given columns, into a table"""
+        if not rows:
+            return
+        if self.postgres:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor = self.connection.connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            cursor.close()
+        else:
+            self.connection.execute(
+                table.insert(), [dict(zip(columns, row)) for row in rows]
+            )
+
+
+class Progress:
+    """Counts the rows written and reports the rate"""
+
+    def __init__(self, report=None):
+        self.report = report
+        self.started = time.perf_counter()
+        self.wishlists = 0
+        self.items = 0
+
+    @property
+    def rate(self) -> float:
+        """Returns the rows written per second so far"""
+        elapsed = time.perf_counter() - self.started
+        return (self.wishlists + self.items) / elapsed if elapsed else 0.0
+
+    def add(self, wishlists: int = 0, items: int = 0):
+        """Adds written rows and reports the totals"""
+        self.wishlists += wishlists
+        self.items += items
+        if self.report:
+            self.report(self)
+
+
+def _item_row(wishlist_id, item):
+    """Returns the item columns of an input item"""
+    return (
+        wishlist_id,
+        int(item["product_id"]),
+        item["product_name"],
+        item["product_price"],
+    )
+
+
+def _remapped_item_row(new_ids, item):
+    """Returns the item columns of an input item of a separate item file"""
+    wishlist_id = new_ids.get(int(item["wishlist_id"]))
+    if wishlist_id is None:
+        raise DataValidationError(
+            f"Item of unknown wishlist_id {item['wishlist_id']} in the input"
+        )
+    return _item_row(wishlist_id, item)
+
+
+def import_wishlists(wishlists, items=None, batch_size=10000, report=None):
+    """
+    Imports wishlists, and their items, in one transaction
+
+    :param wishlists: wishlist dicts with an "id", "name" and "customer_id",
+        and optionally a list of "items" like the NDJSON export
+    :param items: item dicts with the "wishlist_id" of the input wishlists,
+        like a CSV of the item table
+    :param batch_size: the number of rows written per statement
+    :param report: called with the Progress after each batch
+
+    :return: the counts of wishlists and items imported, and the rate
+    :rtype: Progress
+
+    """
+    progress = Progress(report)
+    wishlist_table = Wishlist.__table__
+    item_table = Item.__table__
+    new_ids = {}  # input id -> new id, needed to remap a separate item file
+
+    with db.engine.begin() as connection:
+        writer = BulkWriter(connection)
+        for batch in batched(wishlists, batch_size):
+            ids = writer.reserve_ids(wishlist_table, len(batch))
+            wishlist_rows, item_rows = [], []
+            for new_id, data in zip(ids, batch):
+                if items is not None:
+                    new_ids[int(data["id"])] = new_id
+                wishlist_rows.append((new_id, data["name"], int(data["customer_id"])))
+                item_rows.extend(
+                    _item_row(new_id, item) for item in data.get("items", ())
+                )
+            writer.write(wishlist_table, WISHLIST_COLUMNS, wishlist_rows)
+            writer.write(item_table, ITEM_COLUMNS, item_rows)
+            progress.add(len(wishlist_rows), len(item_rows))
+
+        for batch in batched(items or (), batch_size):
+            item_rows = [_remapped_item_row(new_ids, item) for item in batch]
+            writer.write(item_table, ITEM_COLUMNS, item_rows)
+            progress.add(items=len(item_rows))
+
+    return progress
+
+
+######################################################################
+# Export
+######################################################################
+
+# One JSON document per wishlist, in the format of GET /api/wishlists/export
+WISHLIST_JSON = """
+SELECT json_build_object(
+    'id', w.id, 'name', w.name, 'customer_id', w.customer_id, 'version', w.version,
+    'items', COALESCE((
+        SELECT json_agg(json_build_object(
+            'id', i.id, 'wishlist_id', i.wishlist_id, 'product_id', i.product_id,
+            'product_name', i.product_name, 'product_price', i.product_price
+        ) ORDER BY i.id)
+        FROM item i WHERE i.wishlist_id = w.id
+    ), '[]')
+)
+FROM wishlist w ORDER BY w.id
+"""
+
+
+class ProgressWriter(io.TextIOBase):
+    """A text file wrapper that counts the characters written"""
+
+    def __init__(self, file, report=None, every=1 << 20):
+        super().__init__()
+        self.file = file
+        self.report = report
+        self.every = every
+        self.size = 0
+        self._next_report = every
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        if self.report and self.size >= self._next_report:
+            self._next_report += self.every
+            self.report(self)
+        return len(data)
+
+
+def open_export(path, compress=False):
+    """Opens an export file for writing text, gzip-compressed if asked"""
+    if compress:
+        return gzip.open(path + ".gz", "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def _copy_to(connection, query, file, options="FORMAT csv, HEADER") -> int:
+    """Streams the output of COPY ... TO STDOUT into file"""
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {query} TO STDOUT WITH ({options})", file)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def export_table(connection, table, file, batch_size=10000) -> int:
+    """
+    Writes a table as CSV with a header row
+
+    :return: the number of rows written
+    :rtype: int
+
+    """
+    columns = [column.name for column in table.columns]
+    if connection.dialect.name == "postgresql":
+        return _copy_to(connection, f"{table.name} ({', '.join(columns)})", file)
+
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    result = connection.execution_options(
+        stream_results=True, max_row_buffer=batch_size
+    ).execute(select(table).order_by(table.c.id))
+    count = 0
+    for partition in result.partitions(batch_size):
+        writer.writerows(partition)
+        count += len(partition)
+    return count
+
+
+def export_ndjson(connection, file, batch_size=10000) -> int:
+    """
+    Writes one JSON line per wishlist with its items
+
+    :return: the number of wishlists written
+    :rtype: int
+
+    """
+    if connection.dialect.name == "postgresql":
+        # JSON never holds raw control characters, so with these as the
+        # quote and delimiter COPY writes each document as is
+        return _copy_to(
+            connection,
+            f"({WISHLIST_JSON})",
+            file,
+            "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'",
+        )
+
+    count = 0
+    for wishlist in Wishlist.stream(batch_size=batch_size):
+        file.write(json.dumps(wishlist, default=float) + "\n")
+        count += 1
+    return count
+
+
+def _export(path, compress, report, write):
+    """Writes one export file and returns its path and row count"""
+    with open_export(path, compress) as file:
+        rows = write(ProgressWriter(file, report and (lambda w: report(path, w.size))))
+    return (path + ".gz" if compress else path), rows
+
+
+def export_wishlists(directory, file_format="csv", compress=False, report=None):
+    """
+    Exports the wishlists and items into a directory
+
+    CSV writes wishlist.csv and item.csv, one per table, which
+    import-wishlists reads back with --items. NDJSON writes
+    wishlists.ndjson, one wishlist with its items per line.
+
+    :param directory: the directory of the export files, created if needed
+    :param file_format: "csv" or "ndjson"
+    :param compress: gzip the files and add .gz to their names
+    :param report: called with the path and the characters written so far
+
+    :return: the path and the number of rows of each file written
+    :rtype: list
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    exported = []
+    with db.engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # one snapshot for both tables
+            connection = connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            if file_format == "ndjson":
+                path = os.path.join(directory, "wishlists.ndjson")
+                exported.append(
+                    _export(
+                        path, compress, report, lambda f: export_ndjson(connection, f)
+                    )
+                )
+            else:
+                for table in (Wishlist.__table__, Item.__table__):
+                    path = os.path.join(directory, f"{table.name}.csv")
+                    exported.append(
+                        _export(
+                            path,
+                            compress,
+                            report,
+                            lambda f, t=table: export_table(connection, t, f),
+                        )
+                    )
+    return exported
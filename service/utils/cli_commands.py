@@ -1,8 +1,13 @@
 """
 Flask CLI Command Extensions
 """
+import time
+import click
+from sqlalchemy.exc import SQLAlchemyError
 from service import app
-from service.models import db
+from service import migrations, models
+from service.models import db, DataValidationError
+from service.utils import bulk, profiling
 
 
 ######################################################################
@@ -16,5 +21,184 @@ def create_db():
     production.
     """
     db.drop_all()
-    db.create_all()
+    migrations.version_table.drop(db.engine, checkfirst=True)
+    migrations.upgrade(db.engine)
     db.session.commit()
+
+
+######################################################################
+# Command to apply the schema migrations
+# Usage: flask db-upgrade
+#        flask db-upgrade --target 0002
+######################################################################
+@app.cli.command("db-upgrade")
+@click.option("--target", help="The last migration version to apply.")
+def db_upgrade(target):
+    """
+    Applies the pending schema migrations of service/migrations. Only one
+    process migrates at a time, the others wait for it and find nothing
+    left to do, so this is safe to run on every deploy.
+    """
+
+    def report(migration):
+        click.echo(f"Applying {migration.version}_{migration.name} ...")
+
+    try:
+        applied = models.upgrade_schema(app, target, report)
+    except migrations.MigrationError as error:
+        raise click.ClickException(str(error))
+    if not applied:
+        click.echo("Database schema is up to date")
+    else:
+        click.echo(f"Applied {len(applied)} migrations")
+
+
+######################################################################
+# Command to remove the items repeating a product of their wishlist
+# Usage: flask delete-duplicate-items
+######################################################################
+@app.cli.command("delete-duplicate-items")
+@click.confirmation_option(
+    prompt="Delete all but the oldest item of each repeated product?"
+)
+def delete_duplicate_items():
+    """
+    Deletes the items repeating a product of their wishlist, keeping the
+    oldest of each, so that the 0003 migration can build its unique index.
+    The other items may have a different name or price, check the list
+    printed by db-upgrade first.
+    """
+    with db.engine.begin() as connection:
+        duplicates = migrations.find_duplicate_items(connection)
+        for (wishlist_id, product_id), ids in duplicates.items():
+            click.echo(
+                f"Wishlist {wishlist_id} product {product_id}: keeping item {ids[0]}, "
+                f"deleting {ids[1:]}"
+            )
+        count = migrations.delete_duplicate_items(connection)
+    click.echo(f"Deleted {count} duplicate items")
+
+
+######################################################################
+# Command to load wishlists and items in bulk
+# Usage: flask import-wishlists wishlists.ndjson
+#        flask import-wishlists wishlist.csv --items item.csv
+######################################################################
+@app.cli.command("import-wishlists")
+@click.argument("source", type=click.File("r"))
+@click.option(
+    "--items",
+    type=click.File("r"),
+    help="CSV of the items of a wishlist CSV, with the source wishlist_id.",
+)
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["ndjson", "csv"]),
+    help="Format of SOURCE, by default from its extension.",
+)
+@click.option("--batch-size", default=10000, show_default=True)
+def import_wishlists(source, items, file_format, batch_size):
+    """
+    Imports wishlists and items from NDJSON, like GET /api/wishlists/export,
+    or from CSV files of the wishlist and item tables. New ids are assigned
+    and the items are remapped to them. Use - as SOURCE to read stdin.
+    """
+    if file_format is None:
+        file_format = "csv" if source.name.endswith(".csv") else "ndjson"
+    reader = bulk.read_csv if file_format == "csv" else bulk.read_ndjson
+
+    def report(progress):
+        click.echo(
+            f"Imported {progress.wishlists} wishlists and {progress.items} items "
+            f"({progress.rate:.0f} rows/sec)",
+            err=True,
+        )
+
+    try:
+        progress = bulk.import_wishlists(
+            reader(source),
+            bulk.read_csv(items) if items else None,
+            batch_size=batch_size,
+            report=report,
+        )
+    except (
+        DataValidationError,
+        KeyError,
+        ValueError,
+        db.engine.dialect.dbapi.Error,
+        SQLAlchemyError,
+    ) as error:
+        raise click.ClickException(f"Import failed, nothing was imported: {error!r}")
+
+    click.echo(
+        f"Imported {progress.wishlists} wishlists and {progress.items} items "
+        f"at {progress.rate:.0f} rows/sec"
+    )
+
+
+######################################################################
+# Command to dump wishlists and items for backups and analytics
+# Usage: flask export-wishlists backup/
+#        flask export-wishlists backup/ --format ndjson --gzip
+######################################################################
+@app.cli.command("export-wishlists")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default="csv",
+    show_default=True,
+    help="wishlist.csv and item.csv, or wishlists.ndjson.",
+)
+@click.option("--gzip", "compress", is_flag=True, help="Compress the files with gzip.")
+def export_wishlists(directory, file_format, compress):
+    """
+    Exports the wishlists and items into files in DIRECTORY. The tables are
+    streamed with COPY TO STDOUT on PostgreSQL, so memory stays constant.
+    """
+
+    def report(path, size):
+        click.echo(f"Wrote {size / 2**20:.0f} MiB of {path}", err=True)
+
+    started = time.perf_counter()
+    exported = bulk.export_wishlists(directory, file_format, compress, report)
+    elapsed = time.perf_counter() - started
+    for path, rows in exported:
+        click.echo(f"Exported {rows} rows to {path}")
+    click.echo(f"Done in {elapsed:.1f}s")
+
+
+######################################################################
+# Command to summarize the profiles of slow requests
+# Usage: flask profiles
+#        flask profiles --limit 3 --top 20
+######################################################################
+@app.cli.command("profiles")
+@click.option("--limit", default=5, show_default=True, help="Profiles to list.")
+@click.option("--top", default=10, show_default=True, help="Functions of each.")
+@click.option("--directory", help="Where the profiles are, PROFILE_DIR by default.")
+def show_profiles(limit, top, directory):
+    """
+    Lists the newest request profiles written by this host, see
+    service/utils/profiling.py, with the functions that took the most time
+    in each of them.
+    """
+    directory = directory or app.config["PROFILE_DIR"]
+    found = profiling.list_profiles(directory)
+    if not found:
+        click.echo(f"No profiles in {directory}")
+        return
+    for profile in found[:limit]:
+        click.echo(
+            f"{profile.created:%Y-%m-%d %H:%M:%S} {profile.method} {profile.endpoint} "
+            f"{profile.duration * 1000:.0f}ms pid {profile.pid}: {profile.path}"
+        )
+        click.echo(f"  {'self ms':>9} {'total ms':>9} {'calls':>7}  function")
+        for function in profiling.top_functions(profile, top):
+            calls = "" if function.calls is None else function.calls
+            click.echo(
+                f"  {function.self_time * 1000:>9.1f} {function.total_time * 1000:>9.1f} "
+                f"{calls:>7}  {function.function}"
+            )
@@ -0,0 +1,58 @@
+"""
+Response Compression
+
+This module compresses responses with gzip, or brotli when it is
+installed, depending on what the client accepts in Accept-Encoding.
+Responses smaller than COMPRESS_MIN_SIZE, like /health, are sent as is.
+"""
+import gzip
+from flask import request
+from service import app
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+def choose_encoding():
+    """Returns the best encoding the client accepts, or None"""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding and request.accept_encodings[encoding]:
+        return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses data with the given encoding and the configured level"""
+    if encoding == "br":
+        return brotli.compress(data, quality=app.config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(data, compresslevel=app.config["COMPRESS_LEVEL"], mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses large API responses for clients that accept it"""
+    if not app.config["COMPRESS_ENABLED"]:
+        return response
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or not 200 <= response.status_code < 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in app.config["COMPRESS_MIMETYPES"]
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = choose_encoding()
+    if not encoding:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
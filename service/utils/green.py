@@ -0,0 +1,39 @@
+"""
+Cooperative Workers
+
+Support for gunicorn's gevent workers, which serve many requests at once
+in each worker. psycopg2 is a C extension that gevent cannot patch, so a
+wait callback makes it hand control to the other greenlets while a query
+waits on PostgreSQL instead of blocking the whole worker.
+
+COPY is not supported with a wait callback, so it is only installed in
+the gunicorn workers, never in the CLI commands.
+"""
+import psycopg2
+from psycopg2 import extensions
+
+try:
+    from gevent.socket import wait_read, wait_write
+except ImportError:  # pragma: no cover
+    wait_read = wait_write = None
+
+
+def gevent_wait_callback(connection, timeout=None):
+    """Polls a psycopg2 connection, yielding to other greenlets while it waits"""
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def patch_psycopg():
+    """Makes psycopg2 cooperate with gevent, which must be installed"""
+    if wait_read is None:
+        raise RuntimeError("gevent is not installed")
+    extensions.set_wait_callback(gevent_wait_callback)
@@ -0,0 +1,83 @@
+"""
+Health Checks
+
+This module contains the database check of the readiness probe. Its result
+is cached for HEALTH_CHECK_TTL seconds, so however often the probes come
+at most one SELECT 1 per interval reaches the database from each worker.
+
+The check opens a connection of its own, without a pool, that gives up
+after HEALTH_CHECK_TIMEOUT seconds. A worker whose pool is exhausted by
+requests is busy, not broken, and should stay ready.
+"""
+import logging
+import math
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+# paths of the probes, kept out of the access logs
+PROBE_PATHS = ("/health", "/health/live", "/health/ready")
+
+
+def make_check_engine(url, timeout: float):
+    """Returns an engine without a pool whose connects time out"""
+    connect_args = {}
+    if url.get_backend_name() == "postgresql":
+        # libpq takes whole seconds
+        connect_args["connect_timeout"] = max(1, math.ceil(timeout))
+    elif url.get_backend_name() == "sqlite":
+        connect_args["timeout"] = timeout
+    return create_engine(url, poolclass=NullPool, connect_args=connect_args)
+
+
+class DatabaseCheck:
+    """A cached check that the database answers queries"""
+
+    def __init__(self, engine_getter, timeout: float = 2.0):
+        self._engine_getter = engine_getter
+        self._timeout = timeout
+        self._engine = None
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._error = None
+
+    def engine(self):
+        """Returns the engine of the check, for the database of the app"""
+        url = self._engine_getter().url
+        if self._engine is None or self._engine.url != url:
+            self._engine = make_check_engine(url, self._timeout)
+        return self._engine
+
+    def _run(self):
+        """Runs SELECT 1 and returns the error message, or None"""
+        try:
+            with self.engine().connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except SQLAlchemyError as error:
+            logger.warning("Readiness check failed: %s", error)
+            return type(error).__name__
+        return None
+
+    def check(self, ttl: float = 5.0):
+        """
+        Returns None if the database is reachable, else the error name
+
+        The result is reused for ttl seconds. Concurrent requests wait for
+        the check in flight rather than starting their own.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= ttl:
+                self._error = self._run()
+                self._checked_at = time.monotonic()
+            return self._error
+
+    def reset(self):
+        """Forgets the cached result"""
+        with self._lock:
+            self._checked_at = None
+            self._error = None
@@ -17,22 +17,183 @@
 """
 Log Handlers
 
-This module contains utility functions to set up logging
-consistently
+This module contains utility functions to set up logging consistently.
+
+The service loggers only put their records on a queue, and a listener
+thread formats and writes them with the handlers of gunicorn, so a request
+never waits on log I/O. Set LOG_FORMAT to json for one JSON object per
+line, LOG_LEVELS for the level of single loggers, and LOG_SAMPLE_RATES to
+keep the routine INFO lines of only some of the requests to an endpoint.
 """
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import current_app, has_request_context, request
+from service.utils.health import PROBE_PATHS
+
+# loggers that write one line per request
+ACCESS_LOGGERS = ("gunicorn.access", "werkzeug")
+
+# key of the WSGI environ keeping whether the INFO lines of a request are kept
+SAMPLED = "service.log_sampled"
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# the handler queueing the records of this process and the listener writing them
+_queue_handler = None
+_listener = None
+
+
+class PathFilter(logging.Filter):
+    """Drops the access log lines of requests for some paths"""
+
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = frozenset(paths)
+
+    def filter(self, record):
+        args = record.args
+        if isinstance(args, dict):
+            # gunicorn passes the atoms of its access log format
+            path = args.get("U")
+        elif args and isinstance(args[0], str):
+            # werkzeug passes the request line, like "GET /path HTTP/1.1"
+            parts = args[0].split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else None
+        else:
+            path = None
+        return path not in self.paths
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the INFO lines of only a sample of the requests to an endpoint
+
+    The sample rate of the endpoint, from LOG_SAMPLE_RATES or else
+    LOG_SAMPLE_RATE, is drawn once per request, so a request keeps all of
+    its INFO lines or none. Other levels, and lines logged outside of a
+    request, are always kept.
+    """
+
+    def filter(self, record):
+        if record.levelno != logging.INFO or not has_request_context():
+            return True
+        sampled = request.environ.get(SAMPLED)
+        if sampled is None:
+            config = current_app.config
+            rate = config["LOG_SAMPLE_RATES"].get(
+                request.endpoint, config["LOG_SAMPLE_RATE"]
+            )
+            sampled = request.environ[SAMPLED] = rate >= 1 or random.random() < rate
+        return sampled
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queues records with their message merged but not yet formatted
+
+    The traceback of an exception is kept apart from the message, so the
+    listener can format it as text or as a JSON field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def make_formatter(log_format: str) -> logging.Formatter:
+    """Returns the formatter of LOG_FORMAT, text or json"""
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+
+
+def start_listener(handler: QueueHandler, handlers) -> QueueListener:
+    """Writes the records handler puts on a new queue with handlers"""
+    global _queue_handler, _listener  # pylint: disable=global-statement
+    stop_listener()
+    handler.queue = queue.SimpleQueue()
+    _queue_handler = handler
+    _listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_listener():
+    """Writes the records still queued and stops the listener"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    """Gives a forked worker its own queue and listener thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is None:
+        return
+    # the thread of the parent is not copied, and the records on its queue
+    # are written by the parent, so start over without stopping it
+    handlers, _listener = _listener.handlers, None
+    start_listener(_queue_handler, handlers)
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
+    formatter = make_formatter(app.config["LOG_FORMAT"])
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if handlers and app.config["LOG_QUEUE"]:
+        queue_handler = RecordQueueHandler(None)
+        start_listener(queue_handler, handlers)
+        handlers = [queue_handler]
+    for handler in handlers:
+        handler.addFilter(SamplingFilter())
+    app.logger.handlers = handlers
+    for name, level in app.config["LOG_LEVELS"].items():
+        logging.getLogger(name).setLevel(level.upper())
+    # Keep the health probes out of the access logs
+    for name in ACCESS_LOGGERS:
+        logging.getLogger(name).addFilter(PathFilter(PROBE_PATHS))
     app.logger.info("Logging handler established")
+
+
+atexit.register(stop_listener)
+os.register_at_fork(after_in_child=_restart_after_fork)
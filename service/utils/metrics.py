@@ -0,0 +1,148 @@
+"""
+Metrics
+
+This module serves /metrics in the Prometheus text format with:
+  - counters of the requests by endpoint, method and status
+  - histograms of their latency by endpoint and method
+  - gauges of the requests in progress and of the database pool
+  - a histogram of how long requests waited for a database connection
+
+Under gunicorn every worker is a separate process, so the metrics are
+kept in files in PROMETHEUS_MULTIPROC_DIR, set by gunicorn.conf.py, and
+any worker answering /metrics adds up those of all of them. Without it,
+like in the tests, each process serves its own.
+
+The latency of a streamed response, like the export, only covers the
+time until its headers are sent.
+"""
+import os
+import time
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from service import app
+from service.models import db
+from service.utils import pool
+
+# requests that matched no route are counted together
+UNMATCHED = "<unmatched>"
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests handled",
+    ["endpoint", "method", "status"],
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle an HTTP request",
+    ["endpoint", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being handled",
+    ["endpoint", "method"],
+    multiprocess_mode="livesum",
+)
+POOL = {
+    name: Gauge(
+        f"db_pool_{name}",
+        description,
+        multiprocess_mode="livesum",
+    )
+    for name, description in (
+        ("size", "Configured size of the pools"),
+        ("checked_out", "Connections in use"),
+        ("checked_in", "Idle connections in the pools"),
+        ("overflow", "Connections open beyond the pool sizes"),
+    )
+}
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time waited for a database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Checkouts that timed out waiting for a connection"
+)
+STARTUP = Gauge(
+    "service_startup_seconds",
+    "Time from importing the service to serving",
+    multiprocess_mode="max",
+)
+
+
+def observe_pool_wait(wait_time: float, timed_out: bool):
+    """Records the wait of one checkout from the connection pool"""
+    POOL_WAIT.observe(wait_time)
+    if timed_out:
+        POOL_TIMEOUTS.inc()
+
+
+def update_pool_gauges(connection_pool):
+    """Sets the pool gauges from the pool of this process"""
+    stats = pool.pool_stats(connection_pool)
+    for name, gauge in POOL.items():
+        if name in stats:
+            gauge.set(stats[name])
+
+
+pool.wait_listeners.append(observe_pool_wait)
+pool.state_listeners.append(update_pool_gauges)
+
+
+def registry():
+    """Returns the registry with the metrics of every worker"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+
+######################################################################
+# Request hooks
+######################################################################
+@app.before_request
+def start_request_metrics():
+    """Counts a request as in progress"""
+    labels = (request.endpoint or UNMATCHED, request.method)
+    IN_PROGRESS.labels(*labels).inc()
+    g.metrics = (labels, time.perf_counter())
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Counts a request and records its latency"""
+    if "metrics" in g:
+        (endpoint, method), started = g.metrics
+        LATENCY.labels(endpoint, method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, method, response.status_code).inc()
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):  # pylint: disable=unused-argument
+    """Takes a request out of the in progress gauge, even if it failed"""
+    metrics = g.pop("metrics", None)
+    if metrics:
+        IN_PROGRESS.labels(*metrics[0]).dec()
+
+
+######################################################################
+#  PATH: /metrics
+######################################################################
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics of all of the workers"""
+    STARTUP.set(app.config.get("STARTUP_TIME", 0))
+    update_pool_gauges(db.engine.pool)
+    return Response(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,110 @@
+"""
+Database Connection Pool
+
+This module configures the SQLAlchemy connection pool of each worker from
+SQLALCHEMY_ENGINE_OPTIONS and keeps statistics on it. The pool is a
+QueuePool that also times how long each checkout waits for a connection,
+so /admin/pool can show whether workers are starved of connections.
+"""
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# options only a QueuePool accepts, SQLite gets a StaticPool or a NullPool
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+# functions called with the wait time and timed_out of every checkout
+wait_listeners = []
+# functions called with the pool after every checkout and checkin
+state_listeners = []
+
+
+class PoolStats:
+    """Counters of the time spent waiting for a connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.wait_time_max = 0.0
+
+    def record(self, wait_time: float, timed_out: bool = False):
+        """Records one checkout that waited wait_time seconds"""
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_time += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        for listener in wait_listeners:
+            listener(wait_time, timed_out)
+
+    def as_dict(self) -> dict:
+        """Returns the counters, with times in seconds"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total": round(self.wait_time, 6),
+                "wait_time_max": round(self.wait_time_max, 6),
+                "wait_time_avg": round(self.wait_time / self.checkouts, 6)
+                if self.checkouts
+                else 0.0,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waits"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        self._notify()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._notify()
+
+    def _notify(self):
+        for listener in state_listeners:
+            listener(self)
+
+
+def init_app(app):
+    """Sets the engine options of the app before its engine is created"""
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        for name in QUEUE_POOL_OPTIONS:
+            options.pop(name, None)
+    else:
+        options.setdefault("poolclass", TimedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def pool_stats(pool) -> dict:
+    """Returns the current state of a connection pool"""
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            timeout=pool.timeout(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            # connections opened beyond pool_size, negative while below it
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats.as_dict())
+    return stats
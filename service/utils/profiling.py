@@ -0,0 +1,248 @@
+"""
+Request Profiling
+
+This module profiles single requests, to see where the time of a slow
+endpoint goes in production. It is off unless configured: a request is
+profiled when it sends PROFILE_SECRET in the X-Profile header, or at random
+at PROFILE_SAMPLE_RATE. Each profile is written to PROFILE_DIR, where only
+the newest PROFILE_KEEP are kept, and "flask profiles" lists them with
+their top functions.
+
+Requests are profiled with pyinstrument, a sampling profiler with little
+overhead, when it is installed, or else with cProfile, which traces every
+call and slows the request down. The profile covers the request hooks and
+the view, not the sending of a streamed response. Under gevent the
+greenlets of other requests running meanwhile show up in the profile.
+"""
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+from flask import g, request
+from service import app
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+    from pyinstrument.session import Session
+except ImportError:  # pragma: no cover
+    SamplingProfiler = None
+    Session = None
+
+HEADER = "X-Profile"
+
+# like 20261017T044028123-9124-GET-wishlist_collection-31ms.prof
+PROFILE_NAME = re.compile(
+    r"^(?P<time>\d{8}T\d{9})-(?P<pid>\d+)-(?P<method>[A-Z]+)-(?P<endpoint>\w+)"
+    r"-(?P<duration>\d+)ms\.(?P<kind>prof|pyisession)$"
+)
+
+Profile = namedtuple("Profile", "path created pid method endpoint duration kind")
+FunctionStats = namedtuple("FunctionStats", "function self_time total_time calls")
+
+
+class TracingProfiler:
+    """Profiles a request with cProfile"""
+
+    extension = "prof"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """Starts tracing the calls of this thread"""
+        self.profile.enable()
+
+    def stop(self):
+        """Stops tracing"""
+        self.profile.disable()
+
+    def save(self, path: str):
+        """Writes the profile in the pstats format"""
+        self.profile.dump_stats(path)
+
+
+class SampledProfiler:
+    """Profiles a request with pyinstrument"""
+
+    extension = "pyisession"
+
+    def __init__(self):
+        self.profiler = SamplingProfiler(interval=0.001, async_mode="disabled")
+        self.session = None
+
+    def start(self):
+        """Starts sampling the stack of this thread"""
+        self.profiler.start()
+
+    def stop(self):
+        """Stops sampling"""
+        self.session = self.profiler.stop()
+
+    def save(self, path: str):
+        """Writes the pyinstrument session"""
+        self.session.save(path)
+
+
+def make_profiler(engine: str):
+    """Returns a profiler of PROFILE_ENGINE: auto, cprofile or sampling"""
+    if engine == "cprofile" or (engine == "auto" and SamplingProfiler is None):
+        return TracingProfiler()
+    if SamplingProfiler is None:
+        raise RuntimeError("The sampling profiler needs pyinstrument installed")
+    return SampledProfiler()
+
+
+def should_profile() -> bool:
+    """Returns True if the current request is to be profiled"""
+    secret = app.config["PROFILE_SECRET"]
+    sent = request.headers.get(HEADER)
+    if secret and sent and hmac.compare_digest(sent.encode(), secret.encode()):
+        return True
+    rate = app.config["PROFILE_SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def save_profile(profiler, directory: str, duration: float) -> str:
+    """Writes the profile of the current request and returns its path"""
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.utcnow()
+    name = "{}{:03d}-{}-{}-{}-{}ms.{}".format(
+        now.strftime("%Y%m%dT%H%M%S"),
+        now.microsecond // 1000,
+        os.getpid(),
+        request.method,
+        re.sub(r"\W", "", request.endpoint or "unmatched"),
+        round(duration * 1000),
+        profiler.extension,
+    )
+    path = os.path.join(directory, name)
+    profiler.save(path)
+    return path
+
+
+def list_profiles(directory: str) -> list:
+    """Returns the profiles in directory, the newest first"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        match = PROFILE_NAME.match(name)
+        if match:
+            profiles.append(
+                Profile(
+                    path=os.path.join(directory, name),
+                    created=datetime.strptime(match["time"], "%Y%m%dT%H%M%S%f"),
+                    pid=int(match["pid"]),
+                    method=match["method"],
+                    endpoint=match["endpoint"],
+                    duration=int(match["duration"]) / 1000,
+                    kind=match["kind"],
+                )
+            )
+    return sorted(profiles, key=lambda profile: profile.path, reverse=True)
+
+
+def prune_profiles(directory: str, keep: int):
+    """Deletes all but the newest keep profiles"""
+    for profile in list_profiles(directory)[keep:]:
+        try:
+            os.remove(profile.path)
+        except FileNotFoundError:
+            pass  # removed by another worker
+
+
+def _label(function: str, path: str, line: int) -> str:
+    """Returns a function with the last two parts of its file path"""
+    if not path or path in ("~", "<built-in>"):
+        return function
+    path = "/".join(path.replace(os.sep, "/").split("/")[-2:])
+    return f"{function} ({path}:{line})"
+
+
+def _cprofile_functions(path: str) -> list:
+    """Returns the FunctionStats of a cProfile profile"""
+    stats = pstats.Stats(path).stats  # pylint: disable=no-member
+    return [
+        FunctionStats(_label(name, file, line), self_time, total_time, calls)
+        for (file, line, name), (_, calls, self_time, total_time, _) in stats.items()
+    ]
+
+
+def _pyinstrument_functions(path: str) -> list:
+    """Returns the FunctionStats of a pyinstrument session"""
+    totals = {}
+
+    def walk(frame, callers):
+        if frame.is_synthetic:
+            return
+        key = _label(frame.function, frame.file_path, frame.line_no)
+        self_time, total_time = totals.get(key, (0.0, 0.0))
+        # time in recursive calls is already in the total of the outer call
+        if key not in callers:
+            total_time += frame.time
+        totals[key] = (self_time + frame.total_self_time, total_time)
+        for child in frame.children:
+            walk(child, callers | {key})
+
+    root = Session.load(path).root_frame()
+    if root is not None:
+        walk(root, frozenset())
+    return [
+        FunctionStats(key, self_time, total_time, None)
+        for key, (self_time, total_time) in totals.items()
+    ]
+
+
+def top_functions(profile: Profile, count: int = 10) -> list:
+    """Returns the count functions of a profile that took the most time"""
+    if profile.kind == "prof":
+        functions = _cprofile_functions(profile.path)
+    elif Session is not None:
+        functions = _pyinstrument_functions(profile.path)
+    else:
+        raise RuntimeError("Reading a sampled profile needs pyinstrument installed")
+    functions.sort(key=lambda function: function.self_time, reverse=True)
+    return functions[:count]
+
+
+######################################################################
+# Request hooks
+######################################################################
+@app.before_request
+def start_profile():
+    """Starts profiling the requests chosen for it"""
+    if not should_profile():
+        return
+    profiler = make_profiler(app.config["PROFILE_ENGINE"])
+    try:
+        profiler.start()
+    except (RuntimeError, ValueError) as error:
+        # only one profiler can run at a time in some Python versions
+        app.logger.warning("Cannot profile %s: %s", request.path, error)
+        return
+    g.profiler = (profiler, time.perf_counter())
+
+
+@app.teardown_request
+def stop_profile(error=None):  # pylint: disable=unused-argument
+    """Stops profiling a request and writes its profile"""
+    profiling = g.pop("profiler", None)
+    if profiling is None:
+        return
+    profiler, started = profiling
+    profiler.stop()
+    directory = app.config["PROFILE_DIR"]
+    try:
+        path = save_profile(profiler, directory, time.perf_counter() - started)
+        prune_profiles(directory, app.config["PROFILE_KEEP"])
+    except OSError as os_error:
+        app.logger.warning("Cannot write profile: %s", os_error)
+        return
+    app.logger.info("Wrote profile %s", path)
@@ -0,0 +1,122 @@
+"""
+Query Statistics
+
+This module counts and times the SQL statements each request runs, with
+SQLAlchemy engine events. The totals are sent back in a Server-Timing
+header, written to the request log line, and a warning is logged when an
+endpoint runs more statements than its budget, to catch N+1 queries.
+
+Statements run while a streamed response is sent, like the export, come
+after the headers and are not counted.
+"""
+import time
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service import app
+from service.utils.health import PROBE_PATHS
+
+
+class QueryStats:
+    """The statements run by one request and the time spent in them"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        """Returns the seconds since the request started"""
+        return time.perf_counter() - self.started
+
+
+def current_stats():
+    """Returns the QueryStats of the current request, or None"""
+    if not has_app_context():
+        return None
+    return g.get("query_stats")
+
+
+def query_budget(endpoint) -> int:
+    """Returns the number of statements an endpoint may run before a warning"""
+    return app.config["QUERY_BUDGETS"].get(endpoint, app.config["QUERY_BUDGET"])
+
+
+######################################################################
+# Engine events, of every engine
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Notes when a statement starts"""
+    # pylint: disable=unused-argument, too-many-arguments
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Adds a statement to the statistics of the request"""
+    # pylint: disable=unused-argument, too-many-arguments
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += duration
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    """Forgets the start of a statement that failed"""
+    started = (
+        context.connection.info.get("query_started") if context.connection else None
+    )
+    if started:
+        started.pop()
+
+
+######################################################################
+# Request hooks
+######################################################################
+@app.before_request
+def start_query_stats():
+    """Starts counting the statements of a request"""
+    if app.config["QUERY_STATS_ENABLED"]:
+        g.query_stats = QueryStats()
+
+
+@app.after_request
+def report_query_stats(response):
+    """Reports the statements of a request in the header and the log"""
+    stats = g.pop("query_stats", None)
+    if stats is None:
+        return response
+
+    db_ms = stats.duration * 1000
+    total_ms = stats.elapsed * 1000
+    response.headers.add(
+        "Server-Timing",
+        f'db;desc="{stats.count} queries";dur={db_ms:.1f}, app;dur={total_ms:.1f}',
+    )
+    if request.path in PROBE_PATHS:
+        return response
+
+    app.logger.info(
+        "%s %s %s in %.1fms, %d queries in %.1fms",
+        request.method,
+        request.full_path.rstrip("?"),
+        response.status_code,
+        total_ms,
+        stats.count,
+        db_ms,
+    )
+    budget = query_budget(request.endpoint)
+    if stats.count > budget:
+        app.logger.warning(
+            "%s %s ran %d queries, over the budget of %d of %s",
+            request.method,
+            request.path,
+            stats.count,
+            budget,
+            request.endpoint,
+        )
+    return response
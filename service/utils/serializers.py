@@ -0,0 +1,196 @@
+"""
+Serializers
+
+This module contains a fast response path for the API. Flask-RESTX models
+are compiled once into plain functions that build the response dict, and
+responses are encoded with orjson when it is installed. Set
+FAST_SERIALIZATION to False to use the stock Flask-RESTX path.
+"""
+from decimal import Decimal
+from functools import wraps
+from flask import has_request_context, make_response, request
+from flask_restx import fields, marshal as restx_marshal
+from flask_restx.representations import output_json as restx_output_json
+from flask_restx.utils import unpack
+from service import app, api
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+    import json
+
+
+######################################################################
+# Compiled serializers
+######################################################################
+def _to_int(value):
+    return int(value)
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_str(value):
+    return str(value)
+
+
+def _to_bool(value):
+    return bool(value)
+
+
+FORMATTERS = {
+    fields.Integer: _to_int,
+    fields.Float: _to_float,
+    fields.String: _to_str,
+    fields.Boolean: _to_bool,
+}
+
+
+def _compile_field(field):
+    """Returns a function that formats one value like the field would"""
+    if isinstance(field, type):
+        field = field()
+    if isinstance(field, fields.Nested):
+        nested = compile_model(field.nested, field.skip_none)
+        if field.allow_null:
+            return nested
+        # Flask-RESTX marshals a missing nested object as all of its keys
+        return lambda value: nested(value if value is not None else {})
+    if isinstance(field, fields.List):
+        item = _compile_field(field.container)
+        return lambda value: [item(entry) for entry in value]
+    for field_type, formatter in FORMATTERS.items():
+        if type(field) is field_type:  # pylint: disable=unidiomatic-typecheck
+            return formatter
+    # anything else is formatted by the field itself
+    return field.format
+
+
+def compile_model(model, skip_none=False):
+    """
+    Compiles a Flask-RESTX model into a serializer function
+
+    The function takes a dict and returns the same result as
+    flask_restx.marshal(data, model) for the data our handlers produce,
+    without walking the model field by field on every call.
+    """
+    model = getattr(model, "resolved", model)
+    plan = []
+    for name, field in model.items():
+        attribute = getattr(field, "attribute", None) or name
+        default = getattr(field, "default", None)
+        plan.append((name, attribute, _compile_field(field), default))
+
+    def serialize(data):
+        result = {}
+        for name, attribute, formatter, default in plan:
+            value = data.get(attribute)
+            if value is None:
+                value = default
+                if value is None:
+                    if not skip_none:
+                        result[name] = None
+                    continue
+            result[name] = formatter(value)
+        return result
+
+    return serialize
+
+
+_compiled = {}
+
+
+def get_serializer(model, skip_none=False):
+    """Returns the compiled serializer of a model, compiling it once"""
+    key = (model.name, skip_none)
+    if key not in _compiled:
+        _compiled[key] = compile_model(model, skip_none)
+    return _compiled[key]
+
+
+def request_mask():
+    """Returns the fields mask sent with the current request, if any"""
+    if not has_request_context():
+        return None
+    return request.headers.get(app.config["RESTX_MASK_HEADER"])
+
+
+def use_fast_path():
+    """Returns True if the request can use the compiled serializers"""
+    if not app.config.get("FAST_SERIALIZATION", True):
+        return False
+    # field masks are only supported by Flask-RESTX itself
+    return not request_mask()
+
+
+def marshal(data, model, skip_none=False, mask=None):
+    """
+    Marshals data with a model like flask_restx.marshal, applying the
+    fields mask of the request like @api.marshal_with does
+    """
+    mask = mask or request_mask()
+    if mask or not use_fast_path():
+        return restx_marshal(data, model, skip_none=skip_none, mask=mask)
+    serialize = get_serializer(model, skip_none)
+    if isinstance(data, (list, tuple)):
+        return [serialize(entry) for entry in data]
+    return serialize(data)
+
+
+def marshal_with(model, as_list=False, code=200, skip_none=False):
+    """
+    A drop in replacement for api.marshal_with that uses the compiled
+    serializers, while documenting the response model the same way
+    """
+
+    def decorator(func):
+        documented = api.marshal_with(
+            model, as_list=as_list, code=code, skip_none=skip_none
+        )(func)
+
+        @wraps(documented)
+        def wrapper(*args, **kwargs):
+            if not use_fast_path():
+                return documented(*args, **kwargs)
+            data, status_code, headers = unpack(func(*args, **kwargs))
+            return marshal(data, model, skip_none), status_code, headers
+
+        return wrapper
+
+    return decorator
+
+
+def marshal_list_with(model, **kwargs):
+    """A shortcut for marshal_with(model, as_list=True)"""
+    return marshal_with(model, as_list=True, **kwargs)
+
+
+######################################################################
+# JSON encoding
+######################################################################
+def _default(value):
+    """Encodes the types orjson does not know about"""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data) -> bytes:
+    """Encodes data as JSON, with orjson when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if app.debug else 0
+        return orjson.dumps(data, default=_default, option=option)
+    return json.dumps(data, default=_default).encode("utf-8")
+
+
+@api.representation("application/json")
+def output_json(data, code, headers=None):
+    """Makes a Flask response with a JSON encoded body"""
+    if not app.config.get("FAST_SERIALIZATION", True):
+        return restx_output_json(data, code, headers)
+    resp = make_response(dumps(data) + b"\n", code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = "application/json"
+    return resp
@@ -0,0 +1,5 @@
+"""
+Benchmarks
+
+These modules are run by hand and are not collected by the test runner.
+"""
@@ -0,0 +1,572 @@
+"""
+Endpoint Benchmark
+
+Seeds a dataset of wishlists with items, then sends requests to every
+route of the service, first through the Flask test client and then through
+a real HTTP server on a local port, and records the throughput and the
+p50, p95 and p99 latency of each route.
+
+The results are compared with the baseline of the database in use, in
+tests/benchmarks/baselines/<dialect>.json, and the run fails when a route
+got slower by more than --tolerance, 50% by default as timings on a shared
+machine vary that much, and by more than --min-delta ms so the noise of the
+fastest routes is ignored. Record a new baseline with
+--save-baseline after a change that is meant to make things slower, or on
+a new reference machine. Baselines are only compared with runs on the same
+dataset and number of requests.
+
+DATABASE_URI selects the database, which is emptied first:
+  DATABASE_URI=sqlite:////tmp/benchmark.db python -m tests.benchmarks.endpoints
+  DATABASE_URI=postgresql://postgres@localhost/benchmark \\
+    python -m tests.benchmarks.endpoints --wishlists 1000 --items 10
+"""
+import argparse
+import gc
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import warnings
+from collections import namedtuple
+from sqlalchemy import text
+from sqlalchemy.exc import SAWarning
+from werkzeug.serving import WSGIRequestHandler, make_server
+from service import app, migrations
+from service.models import db, cache, Item
+from tests.factories import WishlistFactory, ItemFactory
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# the metrics compared with the baseline, a higher value being worse
+COMPARED = ("p50", "p95", "mean")
+
+ITEMS_PER_BATCH = 10
+
+
+class Dataset:
+    """The seeded wishlists and items, and those created by the run"""
+
+    def __init__(self, wishlists: list, items: dict):
+        self.wishlists = wishlists  # [(id, customer_id)]
+        self.items = items  # {wishlist id: [(item id, product id)]}
+        self.created_wishlists = []  # [(id, customer_id)]
+        self.created_items = []  # [(wishlist id, item id, product id)]
+        self.product_ids = itertools.count(1_000_000)
+
+    def wishlist(self, i: int):
+        """Returns the id and customer id of the i-th seeded wishlist"""
+        return self.wishlists[i % len(self.wishlists)]
+
+    def item(self, i: int):
+        """Returns the wishlist id, item id and product id of a seeded item"""
+        wishlist_id, _ = self.wishlist(i)
+        items = self.items[wishlist_id]
+        item_id, product_id = items[(i // len(self.wishlists)) % len(items)]
+        return wishlist_id, item_id, product_id
+
+    def created_wishlist(self, i: int):
+        """Returns a wishlist created by the run, each one once"""
+        return self.created_wishlists[i % len(self.created_wishlists)]
+
+    def product(self) -> dict:
+        """Returns the body of an item with a product id never used before"""
+        return {
+            "product_id": next(self.product_ids),
+            "product_name": "Benchmark product",
+            "product_price": 9.99,
+        }
+
+
+# request(dataset, i) returns the path and the JSON body of the i-th request
+Scenario = namedtuple("Scenario", "name method endpoint status request record")
+
+
+def _record_wishlist(dataset, body):
+    dataset.created_wishlists.append((body["id"], body["customer_id"]))
+
+
+def _record_item(dataset, body):
+    dataset.created_items.append((body["wishlist_id"], body["id"], body["product_id"]))
+
+
+def _update_item(dataset, i):
+    wishlist_id, item_id, product_id = dataset.created_items[i]
+    body = dict(dataset.product(), product_id=product_id, product_name="Renamed")
+    return f"/api/wishlists/{wishlist_id}/items/{item_id}", body
+
+
+def _delete_item(dataset, i):
+    wishlist_id, item_id, _ = dataset.created_items[i]
+    return f"/api/wishlists/{wishlist_id}/items/{item_id}", None
+
+
+def _batch(dataset, i):
+    wishlist_id, _ = dataset.created_wishlist(i)
+    body = [dataset.product() for _ in range(ITEMS_PER_BATCH)]
+    return f"/api/wishlists/{wishlist_id}/items:batch", body
+
+
+# In the order they run: reads first, then the writes, the requests that
+# delete last, on the wishlists and items created by the earlier ones
+SCENARIOS = (
+    Scenario("index", "GET", "index", 200, lambda d, i: ("/", None), None),
+    Scenario("health", "GET", "health", 200, lambda d, i: ("/health", None), None),
+    Scenario(
+        "liveness", "GET", "liveness", 200, lambda d, i: ("/health/live", None), None
+    ),
+    Scenario(
+        "readiness",
+        "GET",
+        "readiness",
+        200,
+        lambda d, i: ("/health/ready", None),
+        None,
+    ),
+    Scenario(
+        "cache_stats",
+        "GET",
+        "cache_stats",
+        200,
+        lambda d, i: ("/admin/cache", None),
+        None,
+    ),
+    Scenario(
+        "pool_stats",
+        "GET",
+        "connection_pool_stats",
+        200,
+        lambda d, i: ("/admin/pool", None),
+        None,
+    ),
+    Scenario("metrics", "GET", "metrics", 200, lambda d, i: ("/metrics", None), None),
+    Scenario(
+        "list_wishlists",
+        "GET",
+        "wishlist_collection",
+        200,
+        lambda d, i: ("/api/wishlists", None),
+        None,
+    ),
+    Scenario(
+        "list_wishlists_by_customer",
+        "GET",
+        "wishlist_collection",
+        200,
+        lambda d, i: (f"/api/wishlists?customer_id={d.wishlist(i)[1]}", None),
+        None,
+    ),
+    Scenario(
+        "get_wishlist",
+        "GET",
+        "wishlist_resource",
+        200,
+        lambda d, i: (f"/api/wishlists/{d.wishlist(i)[0]}", None),
+        None,
+    ),
+    Scenario(
+        "wishlist_view",
+        "GET",
+        "wishlist_index",
+        200,
+        lambda d, i: (f"/wishlists/{d.wishlist(i)[0]}", None),
+        None,
+    ),
+    Scenario(
+        "list_items",
+        "GET",
+        "wishlist_items_collection",
+        200,
+        lambda d, i: (f"/api/wishlists/{d.wishlist(i)[0]}/items", None),
+        None,
+    ),
+    Scenario(
+        "get_item",
+        "GET",
+        "wishlist_item_resource",
+        200,
+        lambda d, i: ("/api/wishlists/{}/items/{}".format(*d.item(i)[:2]), None),
+        None,
+    ),
+    Scenario(
+        "export_wishlists",
+        "GET",
+        "wishlist_export",
+        200,
+        lambda d, i: ("/api/wishlists/export", None),
+        None,
+    ),
+    Scenario(
+        "create_wishlist",
+        "POST",
+        "wishlist_collection",
+        201,
+        lambda d, i: ("/api/wishlists", {"name": f"Benchmark {i}", "customer_id": i}),
+        _record_wishlist,
+    ),
+    Scenario(
+        "rename_wishlist",
+        "PUT",
+        "wishlist_resource",
+        200,
+        lambda d, i: (
+            f"/api/wishlists/{d.wishlist(i)[0]}",
+            {"name": f"Renamed {i}", "customer_id": d.wishlist(i)[1]},
+        ),
+        None,
+    ),
+    Scenario(
+        "create_item",
+        "POST",
+        "wishlist_items_collection",
+        201,
+        lambda d, i: (f"/api/wishlists/{d.wishlist(i)[0]}/items", d.product()),
+        _record_item,
+    ),
+    Scenario("update_item", "PUT", "wishlist_item_resource", 200, _update_item, None),
+    Scenario(
+        "delete_item", "DELETE", "wishlist_item_resource", 204, _delete_item, None
+    ),
+    Scenario("add_items_batch", "POST", "wishlist_items_batch", 200, _batch, None),
+    Scenario(
+        "clear_wishlist",
+        "PUT",
+        "clear_resource",
+        200,
+        lambda d, i: (f"/api/wishlists/{d.created_wishlist(i)[0]}/clear", None),
+        None,
+    ),
+    Scenario(
+        "delete_wishlist",
+        "DELETE",
+        "wishlist_resource",
+        204,
+        lambda d, i: (f"/api/wishlists/{d.created_wishlist(i)[0]}", None),
+        None,
+    ),
+)
+
+
+def uncovered_routes() -> list:
+    """Returns the routes of the service without a scenario"""
+    covered = {(scenario.endpoint, scenario.method) for scenario in SCENARIOS}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        # leave out the documentation and static files of Flask and Flask-RESTX
+        if not app.view_functions[rule.endpoint].__module__.startswith("service"):
+            continue
+        for method in sorted(rule.methods - {"HEAD", "OPTIONS"}):
+            if (rule.endpoint, method) not in covered:
+                missing.append(f"{method} {rule.rule}")
+    return missing
+
+
+def seed(wishlists: int, items: int) -> Dataset:
+    """Rebuilds the schema and creates the same wishlists with items"""
+    random.seed(0)
+    with app.app_context():
+        # a new schema, so rows deleted by earlier runs do not slow this one
+        db.drop_all()
+        migrations.version_table.drop(db.engine, checkfirst=True)
+        migrations.upgrade(db.engine)
+        seeded = [WishlistFactory(id=None) for _ in range(wishlists)]
+        db.session.add_all(seeded)
+        db.session.flush()
+        for wishlist in seeded:
+            db.session.add_all(
+                ItemFactory(id=None, wishlist_id=wishlist.id, product_id=product_id)
+                for product_id in range(items)
+            )
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        by_wishlist = {wishlist.id: [] for wishlist in seeded}
+        for item_id, wishlist_id, product_id in db.session.query(
+            Item.id, Item.wishlist_id, Item.product_id
+        ).order_by(Item.id):
+            by_wishlist[wishlist_id].append((item_id, product_id))
+        dataset = Dataset(
+            [(wishlist.id, wishlist.customer_id) for wishlist in seeded], by_wishlist
+        )
+        db.session.remove()
+    cache.clear()
+    return dataset
+
+
+######################################################################
+# Drivers, sending a request and returning its status and JSON body
+######################################################################
+class ClientDriver:
+    """Sends the requests through the Flask test client"""
+
+    name = "client"
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def send(self, method: str, path: str, body=None):
+        """Sends one request and returns its status and body"""
+        resp = self.client.open(path, method=method, json=body)
+        data = resp.get_data()
+        return resp.status_code, data
+
+    def close(self):
+        """Nothing to stop"""
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """Keeps the connection of the client open between requests"""
+
+    protocol_version = "HTTP/1.1"
+    # send small responses at once instead of waiting for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class HttpDriver:
+    """Sends the requests over HTTP to a server in a thread"""
+
+    name = "http"
+
+    def __init__(self):
+        self.server = make_server(
+            "127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveHandler
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.connection = http.client.HTTPConnection(
+            "127.0.0.1", self.server.server_port, timeout=30
+        )
+
+    def send(self, method: str, path: str, body=None):
+        """Sends one request and returns its status and body"""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        self.connection.request(method, path, body, headers)
+        resp = self.connection.getresponse()
+        return resp.status, resp.read()
+
+    def close(self):
+        """Stops the server"""
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {driver.name: driver for driver in (ClientDriver, HttpDriver)}
+
+
+######################################################################
+# Measuring
+######################################################################
+def percentile(latencies: list, fraction: float) -> float:
+    """Returns a percentile of sorted latencies, by the nearest rank"""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    """Returns the throughput and latencies, in ms, of a scenario"""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run_scenario(
+    driver, dataset: Dataset, scenario: Scenario, requests: int, warmup: int
+):
+    """Sends the requests of a scenario and returns its summary"""
+    latencies = []
+    elapsed = 0.0
+    for i in range(warmup + requests):
+        path, body = scenario.request(dataset, i)
+        started = time.perf_counter()
+        status, data = driver.send(scenario.method, path, body)
+        duration = time.perf_counter() - started
+        if status != scenario.status:
+            raise RuntimeError(
+                f"{scenario.name}: {scenario.method} {path} returned {status}, "
+                f"not {scenario.status}: {data[:200]!r}"
+            )
+        if scenario.record:
+            scenario.record(dataset, json.loads(data))
+        if i >= warmup:
+            latencies.append(duration)
+            elapsed += duration
+    return summarize(latencies, elapsed)
+
+
+def run(
+    drivers: list,
+    wishlists: int,
+    items: int,
+    requests: int,
+    warmup: int,
+    rounds: int = 1,
+    report=None,
+):
+    """
+    Runs every scenario with each driver, rounds times
+
+    Each round starts from a freshly seeded dataset, and every metric of a
+    scenario is the best of its rounds, like timeit does, as the rest of
+    the machine only ever makes a round slower.
+    """
+    results = {}
+    for name in drivers:
+        summaries = {scenario.name: [] for scenario in SCENARIOS}
+        for _ in range(rounds):
+            dataset = seed(wishlists, items)
+            driver = DRIVERS[name]()
+            try:
+                for scenario in SCENARIOS:
+                    # collections pausing random requests made the p95 swing
+                    gc.collect()
+                    gc.disable()
+                    summaries[scenario.name].append(
+                        run_scenario(driver, dataset, scenario, requests, warmup)
+                    )
+                    gc.enable()
+            finally:
+                gc.enable()
+                driver.close()
+        results[name] = {}
+        for scenario_name, runs in summaries.items():
+            results[name][scenario_name] = {
+                metric: (max if metric == "rps" else min)(run[metric] for run in runs)
+                for metric in runs[0]
+            }
+            if report:
+                report(name, scenario_name, results[name][scenario_name])
+    return results
+
+
+######################################################################
+# Baselines
+######################################################################
+def baseline_path(dialect: str) -> str:
+    """Returns the path of the baseline of a database dialect"""
+    return os.path.join(BASELINES, f"{dialect}.json")
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """Returns a message for every metric that regressed from the baseline"""
+    regressions = []
+    for driver, scenarios in results.items():
+        for name, summary in scenarios.items():
+            base = baseline.get(driver, {}).get(name)
+            if base is None:
+                continue
+            for metric in COMPARED:
+                current, before = summary[metric], base[metric]
+                if current > before * (1 + tolerance) and current - before > min_delta:
+                    regressions.append(
+                        f"{driver} {name} {metric}: {current:.2f} ms, "
+                        f"was {before:.2f} ms (+{(current / before - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def print_report(driver: str, name: str, summary: dict):
+    """Prints the summary of one scenario"""
+    print(
+        f"{driver:<7} {name:<27} {summary['rps']:>8.0f} {summary['p50']:>8.2f} "
+        f"{summary['p95']:>8.2f} {summary['p99']:>8.2f}"
+    )
+
+
+def main():
+    """Runs the benchmark and compares it with the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wishlists", type=int, default=100)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument("--warmup", type=int, default=20, help="per route, not timed")
+    parser.add_argument("--rounds", type=int, default=3, help="the best is kept")
+    parser.add_argument("--drivers", default="client,http")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--min-delta", type=float, default=1.0, help="milliseconds")
+    parser.add_argument("--baseline", help="by default baselines/<dialect>.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    missing = uncovered_routes()
+    if missing:
+        sys.exit(f"No scenario for: {', '.join(missing)}")
+    logging.getLogger("service").setLevel(logging.ERROR)
+    # the prices of the items are floats on SQLite
+    warnings.filterwarnings("ignore", category=SAWarning)
+    dialect = db.get_engine(app).dialect.name
+    meta = {
+        "database": dialect,
+        "wishlists": args.wishlists,
+        "items": args.items,
+        "requests": args.requests,
+        "rounds": args.rounds,
+    }
+    print(
+        f"{dialect}, {args.wishlists} wishlists x {args.items} items, "
+        f"{args.requests} requests per route"
+    )
+    print(
+        f"{'driver':<7} {'route':<27} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    results = run(
+        args.drivers.split(","),
+        args.wishlists,
+        args.items,
+        args.requests,
+        args.warmup,
+        args.rounds,
+        print_report,
+    )
+
+    path = args.baseline or baseline_path(dialect)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "meta": dict(meta, python=platform.python_version()),
+                    "results": results,
+                },
+                file,
+                indent=2,
+                sort_keys=True,
+            )
+            file.write("\n")
+        print(f"Saved the baseline to {path}")
+        return
+    if not os.path.exists(path):
+        print(f"No baseline in {path}, save one with --save-baseline")
+        return
+    with open(path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    recorded = {key: baseline["meta"].get(key) for key in meta}
+    if recorded != meta:
+        sys.exit(f"The baseline was recorded with {recorded}, not {meta}")
+    regressions = compare(results, baseline["results"], args.tolerance, args.min_delta)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regression beyond {args.tolerance:.0%} of {path}")
+
+
+if __name__ == "__main__":
+    main()
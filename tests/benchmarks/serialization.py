@@ -0,0 +1,53 @@
+"""
+Serialization Benchmark
+
+Compares the stock Flask-RESTX response path (marshal, then json.dumps)
+with the compiled serializers and orjson on a list of wishlists.
+
+Usage:
+  python -m tests.benchmarks.serialization --wishlists 1000 --items 10
+"""
+import argparse
+import json
+import timeit
+from flask_restx import marshal as restx_marshal
+from flask_restx.representations import output_json as restx_output_json
+from service import app
+from service.routes import wishlist_model
+from service.utils import serializers
+from tests.test_serializers import make_wishlist
+
+
+def current_path(data):
+    """Marshals and encodes like Flask-RESTX does"""
+    return restx_output_json(restx_marshal(data, wishlist_model), 200)
+
+
+def fast_path(data):
+    """Marshals and encodes with the compiled serializer and orjson"""
+    return serializers.output_json(serializers.marshal(data, wishlist_model), 200)
+
+
+def main():
+    """Runs both paths and prints the time per response"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wishlists", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = [make_wishlist(args.items) for _ in range(args.wishlists)]
+    with app.test_request_context():
+        current, fast = current_path(data), fast_path(data)
+        assert json.loads(current.get_data()) == json.loads(fast.get_data())
+        results = {}
+        for name, path in (("current", current_path), ("fast", fast_path)):
+            results[name] = min(
+                timeit.repeat(lambda: path(data), number=1, repeat=args.repeat)
+            )
+            print(f"{name:>8}: {results[name] * 1000:8.1f} ms per response")
+    print(f" speedup: {results['current'] / results['fast']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Worker Benchmark
+
+Compares the throughput of the sync and the gevent gunicorn workers, with
+the same number of worker processes, on GET /api/wishlists/{id} with the
+wishlist cache off, so that every request waits on PostgreSQL. The memory
+of the gunicorn processes is shown next to each result.
+
+With --db-latency the workers reach PostgreSQL through a local proxy that
+delays every packet sent to it, like the network between the service and
+its database does in production.
+
+Needs DATABASE_URI to point at a PostgreSQL database it can fill.
+
+Usage:
+  python -m tests.benchmarks.workers --workers 2 --concurrency 64 --db-latency 2
+"""
+import argparse
+import asyncio
+import http.client
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.engine import make_url
+from service import app, models
+from tests.factories import WishlistFactory, ItemFactory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(count: int, items: int) -> list:
+    """Creates count wishlists with items and returns their ids"""
+    models.upgrade_schema(app)
+    ids = []
+    with app.app_context():
+        for _ in range(count):
+            wishlist = WishlistFactory()
+            wishlist.create()
+            for product_id in range(items):
+                ItemFactory(wishlist_id=wishlist.id, product_id=product_id).create()
+            ids.append(wishlist.id)
+    return ids
+
+
+def rss_mib(pid: int) -> float:
+    """Returns the resident memory of a process and its children in MiB"""
+    pids = {pid}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat", encoding="ascii") as file:
+                    fields = file.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                pids.add(int(entry))
+    total = 0
+    for child in pids:
+        with open(f"/proc/{child}/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+    return total / 1024
+
+
+class LatencyProxy:
+    """A TCP proxy to PostgreSQL that delays what is sent to it"""
+
+    def __init__(self, database_uri: str, latency: float):
+        self.url = make_url(database_uri)
+        self.latency = latency
+        self.port = None
+        self._ready = threading.Event()
+        threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True).start()
+        self._ready.wait()
+
+    @property
+    def database_uri(self) -> str:
+        """Returns the URI of the database through the proxy"""
+        query = {key: value for key, value in self.url.query.items() if key != "host"}
+        return str(self.url.set(host="127.0.0.1", port=self.port, query=query))
+
+    async def _open_upstream(self):
+        socket_dir = self.url.query.get("host")
+        if socket_dir:
+            path = f"{socket_dir}/.s.PGSQL.{self.url.port or 5432}"
+            return await asyncio.open_unix_connection(path)
+        return await asyncio.open_connection(self.url.host, self.url.port or 5432)
+
+    async def _pump(self, reader, writer, delay):
+        try:
+            while data := await reader.read(65536):
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader, client_writer):
+        upstream_reader, upstream_writer = await self._open_upstream()
+        await asyncio.gather(
+            self._pump(client_reader, upstream_writer, self.latency),
+            self._pump(upstream_reader, client_writer, 0),
+        )
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+
+def start_server(worker_class: str, workers: int, port: int, database_uri: str):
+    """Starts gunicorn and waits until it answers"""
+    env = dict(
+        os.environ,
+        DATABASE_URI=database_uri,
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(workers),
+        # one thread, or gunicorn.conf.py makes the sync workers gthread ones
+        GUNICORN_THREADS="1",
+        PORT=str(port),
+        WISHLIST_CACHE_TTL="0",
+    )
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--log-level=warning",
+            "service:create_app()",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            request("127.0.0.1", port, "/health/live")
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn with {worker_class} workers did not start")
+
+
+def request(host: str, port: int, path: str) -> int:
+    """Sends one GET on a new connection and returns the status"""
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def load(port: int, ids: list, concurrency: int, duration: float) -> dict:
+    """Sends requests from concurrency clients for duration seconds"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        mine, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = (
+                    request("127.0.0.1", port, f"/api/wishlists/{random.choice(ids)}")
+                    == 200
+                )
+            except OSError:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return (
+            latencies[int(fraction * (len(latencies) - 1))] * 1000 if latencies else 0.0
+        )
+
+    return {
+        "rps": len(latencies) / duration,
+        "p50": percentile(0.50),
+        "p99": percentile(0.99),
+        "errors": sum(errors),
+    }
+
+
+def main():
+    """Runs the load against each worker class and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--wishlists", type=int, default=200)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8093)
+    parser.add_argument(
+        "--db-latency", type=float, default=0, help="milliseconds added per query"
+    )
+    args = parser.parse_args()
+
+    ids = seed(args.wishlists, args.items)
+    database_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if args.db_latency:
+        database_uri = LatencyProxy(database_uri, args.db_latency / 1000).database_uri
+    print(
+        f"{args.workers} workers, {args.concurrency} clients, {args.duration:.0f}s each, "
+        f"{args.db_latency:g} ms database latency"
+    )
+    print(
+        f"{'worker':<8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MiB':>8}"
+    )
+    for worker_class in ("sync", "gevent"):
+        server = start_server(worker_class, args.workers, args.port, database_uri)
+        try:
+            load(args.port, ids, args.concurrency, 1)  # warm up
+            result = load(args.port, ids, args.concurrency, args.duration)
+            memory = rss_mib(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{worker_class:<8} {result['rps']:>8.0f} {result['p50']:>8.1f} "
+            f"{result['p99']:>8.1f} {result['errors']:>7} {memory:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
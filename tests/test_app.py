@@ -0,0 +1,43 @@
+"""
+Test cases for the Application Factory
+
+"""
+from unittest import TestCase
+from unittest.mock import patch
+from service import app, create_app
+
+
+######################################################################
+#  A P P L I C A T I O N   F A C T O R Y   T E S T   C A S E S
+######################################################################
+class TestCreateApp(TestCase):
+    """Test Cases for create_app()"""
+
+    def setUp(self):
+        self.auto_upgrade = app.config["DB_AUTO_UPGRADE"]
+
+    def tearDown(self):
+        app.config["DB_AUTO_UPGRADE"] = self.auto_upgrade
+
+    @patch("service.models.upgrade_schema")
+    def test_create_app(self, upgrade_schema):
+        """It should migrate the schema and measure the startup time"""
+        app.config["DB_AUTO_UPGRADE"] = True
+        self.assertIs(create_app(), app)
+        upgrade_schema.assert_called_once_with(app)
+        self.assertGreater(app.config["STARTUP_TIME"], 0)
+
+    @patch("service.models.upgrade_schema")
+    def test_create_app_without_schema(self, upgrade_schema):
+        """It should leave the schema alone when DB_AUTO_UPGRADE is off"""
+        app.config["DB_AUTO_UPGRADE"] = False
+        self.assertIs(create_app(), app)
+        upgrade_schema.assert_not_called()
+
+    @patch("service.models.upgrade_schema", side_effect=Exception("no database"))
+    def test_create_app_fails(self, _):
+        """It should exit with code 4 so gunicorn stops spawning workers"""
+        app.config["DB_AUTO_UPGRADE"] = True
+        with self.assertRaises(SystemExit) as context:
+            create_app()
+        self.assertEqual(context.exception.code, 4)
@@ -0,0 +1,92 @@
+"""
+Test cases for Response Compression
+
+"""
+import gzip
+import json
+from unittest import TestCase, skipUnless
+from service import app
+from service.utils import compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LARGE = {"wishlists": [{"name": f"wishlist {n}", "customer_id": n} for n in range(100)]}
+
+
+@app.route("/test/compression/large")
+def large_json():
+    """A response above the compression threshold"""
+    return LARGE
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Test Cases for Response Compression"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_gzip(self):
+        """It should gzip large responses when the client accepts it"""
+        response = self.client.get(
+            "/test/compression/large", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), LARGE)
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli(self):
+        """It should prefer brotli when it is installed and accepted"""
+        response = self.client.get(
+            "/test/compression/large", headers={"Accept-Encoding": "gzip, br"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(json.loads(brotli.decompress(response.data)), LARGE)
+
+    def test_not_accepted(self):
+        """It should not compress when the client does not accept it"""
+        for accept in ("", "identity", "gzip;q=0"):
+            response = self.client.get(
+                "/test/compression/large", headers={"Accept-Encoding": accept}
+            )
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(response.get_json(), LARGE)
+
+    def test_small_response(self):
+        """It should not compress responses below the threshold"""
+        response = self.client.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json()["status"], "OK")
+
+    def test_disabled(self):
+        """It should not compress when compression is disabled"""
+        app.config["COMPRESS_ENABLED"] = False
+        try:
+            response = self.client.get(
+                "/test/compression/large", headers={"Accept-Encoding": "gzip"}
+            )
+        finally:
+            app.config["COMPRESS_ENABLED"] = True
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_compress_level(self):
+        """It should compress with the configured gzip level"""
+        data = json.dumps(LARGE).encode()
+        with app.app_context():
+            app.config["COMPRESS_LEVEL"] = 1
+            fast = compression.compress(data, "gzip")
+            app.config["COMPRESS_LEVEL"] = 9
+            small = compression.compress(data, "gzip")
+            app.config["COMPRESS_LEVEL"] = 6
+        # the XFL byte of the gzip header records the fastest/best level
+        self.assertEqual(fast[8], 4)
+        self.assertEqual(small[8], 2)
+        self.assertEqual(gzip.decompress(fast), data)
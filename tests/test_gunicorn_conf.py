@@ -0,0 +1,123 @@
+"""
+Test cases for the Gunicorn Configuration
+
+"""
+import os
+import shutil
+import tempfile
+import importlib.util
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_conf(**env):
+    """Loads gunicorn.conf.py with the given environment variables"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF)
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, env):
+        spec.loader.exec_module(module)
+    return module
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G U R A T I O N   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(TestCase):
+    """Test Cases for gunicorn.conf.py"""
+
+    def setUp(self):
+        self.conf = load_conf()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _write(self, path, content):
+        """Writes a cgroup file under the temporary root"""
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="ascii") as file:
+            file.write(content + "\n")
+
+    @patch("os.sched_getaffinity", return_value={0, 1, 2, 3})
+    def test_cgroup_v2_limits(self, _):
+        """It should read the limits of cgroup v2"""
+        self._write("cpu.max", "40000 100000")
+        self._write("memory.max", str(128 * 2**20))
+        self.assertAlmostEqual(self.conf.cpu_limit(self.root), 0.4)
+        self.assertEqual(self.conf.memory_limit(self.root), 128 * 2**20)
+
+    @patch("os.sched_getaffinity", return_value={0, 1, 2, 3})
+    def test_cgroup_v2_no_limits(self, _):
+        """It should use the CPUs of the node when cgroup v2 has no limits"""
+        self._write("cpu.max", "max 100000")
+        self._write("memory.max", "max")
+        self.assertEqual(self.conf.cpu_limit(self.root), 4)
+        self.assertIsNone(self.conf.memory_limit(self.root))
+
+    @patch("os.sched_getaffinity", return_value={0, 1, 2, 3})
+    def test_cgroup_v1_limits(self, _):
+        """It should read the limits of cgroup v1"""
+        self._write("cpu/cpu.cfs_quota_us", "150000")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self._write("memory/memory.limit_in_bytes", str(2**30))
+        self.assertEqual(self.conf.cpu_limit(self.root), 1.5)
+        self.assertEqual(self.conf.memory_limit(self.root), 2**30)
+
+    @patch("os.sched_getaffinity", return_value={0, 1})
+    def test_cgroup_v1_no_limits(self, _):
+        """It should treat a quota of -1 and a huge memory limit as none"""
+        self._write("cpu/cpu.cfs_quota_us", "-1")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self._write("memory/memory.limit_in_bytes", "9223372036854771712")
+        self.assertEqual(self.conf.cpu_limit(self.root), 2)
+        self.assertIsNone(self.conf.memory_limit(self.root))
+
+    def test_size_workers(self):
+        """It should size workers by CPU and make up for memory with threads"""
+        mib = 2**20
+        self.assertEqual(self.conf.size_workers(2, None, 64 * mib), (5, 1))
+        self.assertEqual(self.conf.size_workers(2, 2048 * mib, 64 * mib), (5, 1))
+        # the production pods: 0.4 CPU and 128Mi
+        self.assertEqual(self.conf.size_workers(0.4, 128 * mib, 64 * mib), (1, 3))
+        self.assertEqual(self.conf.size_workers(4, 256 * mib, 64 * mib), (3, 3))
+        self.assertEqual(self.conf.size_workers(64, 64 * mib, 64 * mib), (1, 8))
+
+    def test_settings(self):
+        """It should preload sync workers and replace them with jitter"""
+        conf = load_conf(
+            GUNICORN_WORKERS="3", GUNICORN_THREADS="8", GUNICORN_MAX_REQUESTS="500"
+        )
+        self.assertEqual(conf.workers, 3)
+        self.assertEqual(conf.threads, 8)
+        self.assertTrue(conf.preload_app)
+        self.assertEqual(conf.max_requests, 500)
+        self.assertEqual(conf.max_requests_jitter, 50)
+
+    def test_gevent_settings(self):
+        """It should not preload gevent workers"""
+        conf = load_conf(GUNICORN_WORKER_CLASS="gevent")
+        self.assertFalse(conf.preload_app)
+        self.assertEqual(conf.worker_connections, 100)
+
+    def test_when_ready(self):
+        """It should log the chosen settings"""
+        server = MagicMock()
+        server.cfg.worker_class.__name__ = "SyncWorker"
+        self.conf.when_ready(server)
+        self.assertEqual(server.log.info.call_count, 2)
+
+    def test_metrics_dir(self):
+        """It should empty the metrics directory and drop dead workers"""
+        stale = os.path.join(self.root, "counter_123.db")
+        gauge = os.path.join(self.root, "gauge_livesum_456.db")
+        for path in (stale, gauge):
+            with open(path, "wb"):
+                pass
+        conf = load_conf(PROMETHEUS_MULTIPROC_DIR=self.root)
+        self.assertEqual(conf.metrics_dir, self.root)
+        self.assertFalse(os.path.exists(stale))
+        with open(gauge, "wb"):
+            pass
+        conf.child_exit(MagicMock(), MagicMock(pid=456))
+        self.assertFalse(os.path.exists(gauge))
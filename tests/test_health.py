@@ -0,0 +1,94 @@
+"""
+Test cases for the Health Checks
+
+"""
+import logging
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+from service.utils.health import DatabaseCheck, PROBE_PATHS, make_check_engine
+from service.utils.log_handlers import PathFilter
+
+
+def access_record(*args):
+    """Returns a log record with the given arguments"""
+    return logging.LogRecord("access", logging.INFO, __file__, 1, "%s", args, None)
+
+
+######################################################################
+#  H E A L T H   C H E C K   T E S T   C A S E S
+######################################################################
+class TestDatabaseCheck(TestCase):
+    """Test Cases for the cached database check"""
+
+    def setUp(self):
+        self.app_engine = MagicMock(url=make_url("postgresql://postgres@db/wishlists"))
+        self.check = DatabaseCheck(lambda: self.app_engine, timeout=1.5)
+        self.engine = MagicMock(url=self.app_engine.url)
+        patcher = patch("service.utils.health.create_engine", return_value=self.engine)
+        self.create_engine = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_check_is_cached(self):
+        """It should only query the database once per interval"""
+        with patch("service.utils.health.time.monotonic", side_effect=[0, 0, 1, 5, 5]):
+            self.assertIsNone(self.check.check(ttl=5))
+            self.assertIsNone(self.check.check(ttl=5))
+            self.assertIsNone(self.check.check(ttl=5))
+        self.assertEqual(self.engine.connect.call_count, 2)
+
+    def test_own_engine(self):
+        """It should not use the connection pool of the app"""
+        self.assertIsNone(self.check.check())
+        self.app_engine.connect.assert_not_called()
+        self.create_engine.assert_called_once_with(
+            self.app_engine.url, poolclass=NullPool, connect_args={"connect_timeout": 2}
+        )
+        self.check.engine()
+        self.assertEqual(self.create_engine.call_count, 1)
+
+    def test_check_fails(self):
+        """It should return the name of the error"""
+        self.engine.connect.side_effect = OperationalError("SELECT 1", {}, Exception())
+        self.assertEqual(self.check.check(), "OperationalError")
+        self.engine.connect.side_effect = None
+        self.assertEqual(self.check.check(), "OperationalError")
+        self.check.reset()
+        self.assertIsNone(self.check.check())
+
+
+class TestCheckEngine(TestCase):
+    """Test Cases for the engine of the database check"""
+
+    def test_sqlite(self):
+        """It should connect to SQLite without a pool"""
+        engine = make_check_engine(make_url("sqlite://"), 0.5)
+        self.assertIsInstance(engine.pool, NullPool)
+        with engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql("SELECT 1").scalar(), 1)
+
+
+class TestPathFilter(TestCase):
+    """Test Cases for keeping the probes out of the access logs"""
+
+    def setUp(self):
+        self.filter = PathFilter(PROBE_PATHS)
+
+    def test_gunicorn(self):
+        """It should drop gunicorn access lines of the probes"""
+        self.assertFalse(self.filter.filter(access_record({"U": "/health/ready"})))
+        self.assertTrue(self.filter.filter(access_record({"U": "/api/wishlists"})))
+
+    def test_werkzeug(self):
+        """It should drop werkzeug access lines of the probes"""
+        record = access_record("GET /health/live?x=1 HTTP/1.1", "200", "-")
+        self.assertFalse(self.filter.filter(record))
+        record = access_record("GET /api/wishlists HTTP/1.1", "200", "-")
+        self.assertTrue(self.filter.filter(record))
+
+    def test_other_records(self):
+        """It should keep records that are not access lines"""
+        self.assertTrue(self.filter.filter(access_record()))
+        self.assertTrue(self.filter.filter(access_record("message")))
@@ -0,0 +1,163 @@
+"""
+Test cases for the Log Handlers
+
+"""
+import io
+import json
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.utils import log_handlers
+from service.utils.log_handlers import JsonFormatter, SamplingFilter
+
+CONFIG = (
+    "LOG_FORMAT",
+    "LOG_QUEUE",
+    "LOG_LEVELS",
+    "LOG_SAMPLE_RATE",
+    "LOG_SAMPLE_RATES",
+)
+
+
+def make_record(level=logging.INFO, msg="Processing %s", args=("it",), exc_info=None):
+    """Returns a log record of the models"""
+    return logging.LogRecord("service.models", level, __file__, 1, msg, args, exc_info)
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Test Cases for the logging set up"""
+
+    def setUp(self):
+        self.config = {key: app.config[key] for key in CONFIG}
+        self.logger = app.logger
+        self.saved = (self.logger.handlers, self.logger.level, self.logger.propagate)
+        self.stream = io.StringIO()
+        gunicorn_logger = logging.getLogger("tests.gunicorn.error")
+        gunicorn_logger.handlers = [logging.StreamHandler(self.stream)]
+        gunicorn_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        log_handlers.stop_listener()
+        app.config.update(self.config)
+        self.logger.handlers, level, self.logger.propagate = self.saved
+        self.logger.setLevel(level)
+        logging.getLogger("service.models").setLevel(logging.NOTSET)
+
+    def _init(self, **config):
+        """Sets up logging to self.stream with config"""
+        app.config.update(config)
+        log_handlers.init_logging(app, "tests.gunicorn.error")
+
+    def _lines(self):
+        """Returns the lines written once the queue is empty"""
+        log_handlers.stop_listener()
+        return self.stream.getvalue().splitlines()
+
+    def test_queued(self):
+        """It should write the records from a listener thread"""
+        self._init(LOG_FORMAT="text", LOG_QUEUE=True, LOG_LEVELS={})
+        self.assertIsInstance(self.logger.handlers[0], log_handlers.RecordQueueHandler)
+        logging.getLogger("service.models").info("Processing %s", "wishlist")
+        lines = self._lines()
+        self.assertIn("Logging handler established", lines[0])
+        self.assertRegex(lines[1], r"^\[.+\] \[INFO\] \[test_log_handlers\] ")
+        self.assertTrue(lines[1].endswith("Processing wishlist"))
+
+    def test_not_queued(self):
+        """It should write the records directly when the queue is off"""
+        self._init(LOG_FORMAT="text", LOG_QUEUE=False, LOG_LEVELS={})
+        self.assertIsInstance(self.logger.handlers[0], logging.StreamHandler)
+        self.assertIn("Logging handler established", self.stream.getvalue())
+
+    def test_json(self):
+        """It should write one JSON object per line"""
+        self._init(LOG_FORMAT="json", LOG_QUEUE=True, LOG_LEVELS={})
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            logging.getLogger("service.models").exception("Failed %d", 1)
+        entry = json.loads(self._lines()[-1])
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["logger"], "service.models")
+        self.assertEqual(entry["message"], "Failed 1")
+        self.assertIn("ValueError: bad", entry["exception"])
+
+    def test_levels(self):
+        """It should set the level of single loggers"""
+        self._init(LOG_QUEUE=True, LOG_LEVELS={"service.models": "warning"})
+        logging.getLogger("service.models").info("Processing quietly")
+        logging.getLogger("service.routes").info("Request for the list")
+        lines = "\n".join(self._lines())
+        self.assertNotIn("Processing quietly", lines)
+        self.assertIn("Request for the list", lines)
+
+    def test_restart_after_fork(self):
+        """It should give a forked process its own queue and listener"""
+        self._init(LOG_QUEUE=True, LOG_LEVELS={})
+        handler = self.logger.handlers[0]
+        old_queue = handler.queue
+        log_handlers._restart_after_fork()  # pylint: disable=protected-access
+        self.assertIsNot(handler.queue, old_queue)
+        logging.getLogger("service.models").info("Written by the worker")
+        self.assertIn("Written by the worker", self._lines()[-1])
+
+    def test_json_formatter(self):
+        """It should format the fields of a record as JSON"""
+        entry = json.loads(JsonFormatter().format(make_record()))
+        self.assertEqual(entry["message"], "Processing it")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertNotIn("exception", entry)
+
+
+######################################################################
+#  S A M P L I N G   T E S T   C A S E S
+######################################################################
+class TestSamplingFilter(TestCase):
+    """Test Cases for the sampling of the routine log lines"""
+
+    def setUp(self):
+        self.config = {key: app.config[key] for key in CONFIG}
+        self.filter = SamplingFilter()
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def test_outside_request(self):
+        """It should keep the lines logged outside of a request"""
+        app.config.update(LOG_SAMPLE_RATE=0, LOG_SAMPLE_RATES={})
+        self.assertTrue(self.filter.filter(make_record()))
+
+    def test_endpoint_rate(self):
+        """It should drop the INFO lines of endpoints sampled at 0"""
+        app.config.update(
+            LOG_SAMPLE_RATE=1, LOG_SAMPLE_RATES={"wishlist_collection": 0}
+        )
+        with app.test_request_context("/api/wishlists"):
+            self.assertFalse(self.filter.filter(make_record()))
+            self.assertTrue(self.filter.filter(make_record(logging.WARNING)))
+        with app.test_request_context("/health/live"):
+            self.assertTrue(self.filter.filter(make_record()))
+
+    def test_default_rate(self):
+        """It should sample the other endpoints at LOG_SAMPLE_RATE"""
+        app.config.update(LOG_SAMPLE_RATE=0, LOG_SAMPLE_RATES={"liveness": 1})
+        with app.test_request_context("/api/wishlists"):
+            self.assertFalse(self.filter.filter(make_record()))
+        with app.test_request_context("/health/live"):
+            self.assertTrue(self.filter.filter(make_record()))
+
+    @patch("service.utils.log_handlers.random.random", side_effect=[0.2, 0.8])
+    def test_drawn_per_request(self, random):
+        """It should keep all of the lines of a request or none"""
+        app.config.update(LOG_SAMPLE_RATE=0.5, LOG_SAMPLE_RATES={})
+        with app.test_request_context("/api/wishlists"):
+            self.assertTrue(self.filter.filter(make_record()))
+            self.assertTrue(self.filter.filter(make_record()))
+        with app.test_request_context("/api/wishlists"):
+            self.assertFalse(self.filter.filter(make_record()))
+            self.assertFalse(self.filter.filter(make_record()))
+        self.assertEqual(random.call_count, 2)
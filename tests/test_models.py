@@ -3,10 +3,14 @@ Test cases for Wishlist Model
 
 """
 import os
+import pickle
 import logging
 import unittest
+from unittest.mock import patch
+from sqlalchemy import update
 from werkzeug.exceptions import NotFound
 from service.models import Wishlist, Item, DataValidationError, db
+from service.models import CacheBackend, LRUCacheBackend, WishlistCache, cache
 from service import app
 from tests.factories import WishlistFactory, ItemFactory
 
@@ -188,6 +192,78 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(found[0].name, wishlists[3].name)
         self.assertEqual(found[0].customer_id, wishlists[3].customer_id)
 
+    def test_rename_a_wishlist(self):
+        """It should Rename a Wishlist only for its customer"""
+        wishlist = Wishlist(name="Summer", customer_id=20)
+        wishlist.create()
+        self.assertIsNone(Wishlist.rename(wishlist.id, 21, "Winter"))
+        self.assertIsNone(Wishlist.rename(0, 20, "Winter"))
+        self.assertEqual(Wishlist.find(wishlist.id).name, "Summer")
+        data = Wishlist.rename(wishlist.id, 20, "Winter")
+        self.assertEqual(
+            data, {"id": wishlist.id, "name": "Winter", "customer_id": 20, "version": 2}
+        )
+        self.assertEqual(Wishlist.find(wishlist.id).name, "Winter")
+
+    def test_find_version(self):
+        """It should bump the version of a Wishlist on every write"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 1)
+        self.assertIsNone(Wishlist.find_version(0))
+
+        wishlist.name = "Winter"
+        wishlist.update()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 2)
+
+        item = Item(
+            wishlist_id=wishlist.id, product_id=1, product_name="ball", product_price=1
+        )
+        item.create()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 3)
+        item.update()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 4)
+        self.assertFalse(Item.create_or_get_all([item])[0])
+        self.assertEqual(Wishlist.find_version(wishlist.id), 4)
+        item.delete()
+        self.assertEqual(Wishlist.find_version(wishlist.id), 5)
+        Item.delete_by_wishlist_id(wishlist.id)
+        self.assertEqual(Wishlist.find_version(wishlist.id), 5)
+
+    def test_find_page(self):
+        """It should Find a page of Wishlists after a cursor"""
+        wishlists = WishlistFactory.create_batch(5)
+        for wishlist in wishlists:
+            wishlist.create()
+        ids = sorted(wishlist.id for wishlist in wishlists)
+        page = Wishlist.find_page({}, None, 2)
+        self.assertEqual([wishlist.id for wishlist in page], ids[:2])
+        page = Wishlist.find_page({}, ids[1], 2)
+        self.assertEqual([wishlist.id for wishlist in page], ids[2:4])
+        page = Wishlist.find_page({}, ids[-1], 2)
+        self.assertEqual(page, [])
+        customer_id = wishlists[3].customer_id
+        page = Wishlist.find_page({"customer_id": customer_id}, None, 10)
+        for wishlist in page:
+            self.assertEqual(wishlist.customer_id, customer_id)
+
+    def test_stream(self):
+        """It should Stream every Wishlist with its items"""
+        wishlists = WishlistFactory.create_batch(3)
+        for wishlist in wishlists:
+            wishlist.create()
+        items = [ItemFactory(wishlist_id=wishlists[0].id, product_id=n) for n in (1, 2)]
+        Item.create_or_get_all(items)
+        streamed = list(Wishlist.stream(batch_size=1))
+        self.assertEqual(len(streamed), 3)
+        self.assertEqual(
+            streamed[0], Wishlist.find(wishlists[0].id).serialize_with_items()
+        )
+        self.assertEqual(streamed[1]["items"], [])
+        customer_id = wishlists[2].customer_id
+        for data in Wishlist.stream(customer_id):
+            self.assertEqual(data["customer_id"], customer_id)
+
     def test_find_by_customer_id(self):
         """It should Find Wishlists by Customer_IDs"""
         wishlists = WishlistFactory.create_batch(10)
@@ -294,6 +370,66 @@ class TestItem(unittest.TestCase):
 
         self.assertGreater(len(results), 0)
 
+    def test_create_or_get_wishlist_item(self):
+        """It should add a product to a wishlist only once"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+
+        item = Item(
+            wishlist_id=wishlist.id,
+            product_id=10,
+            product_name="ball",
+            product_price=10.4,
+        )
+        self.assertTrue(item.create_or_get())
+        self.assertIsNotNone(item.id)
+
+        duplicate = Item(
+            wishlist_id=wishlist.id,
+            product_id=10,
+            product_name="bat",
+            product_price=99,
+        )
+        self.assertFalse(duplicate.create_or_get())
+        self.assertEqual(duplicate.id, item.id)
+        self.assertEqual(duplicate.product_name, "ball")
+        self.assertEqual(
+            Item.find_by_wishlist_id_and_product_id(wishlist.id, 10).count(), 1
+        )
+
+    def test_create_or_get_wishlist_item_no_wishlist(self):
+        """It should not add a product to a wishlist that does not exist"""
+        item = Item(wishlist_id=0, product_id=10, product_name="ball", product_price=1)
+        self.assertIsNone(item.create_or_get())
+
+    def test_create_or_get_all_wishlist_items(self):
+        """It should add many products to a wishlist in one statement"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        items = [ItemFactory(wishlist_id=wishlist.id, product_id=n) for n in (1, 2, 1)]
+        self.assertEqual(Item.create_or_get_all(items), [True, True, False])
+        self.assertEqual(items[2].id, items[0].id)
+        self.assertEqual(Item.find_by_wishlist_id(wishlist.id).count(), 2)
+        self.assertEqual(Item.create_or_get_all(items[:2]), [False, False])
+        self.assertEqual(Item.create_or_get_all([]), [])
+
+    def test_delete_by_wishlist_id(self):
+        """It should Delete all of the items of a Wishlist"""
+        wishlists = WishlistFactory.create_batch(2)
+        for wishlist in wishlists:
+            wishlist.create()
+        for wishlist in wishlists:
+            items = [
+                ItemFactory(wishlist_id=wishlist.id, product_id=n) for n in range(3)
+            ]
+            Item.create_or_get_all(items)
+        version = Wishlist.find_version(wishlists[0].id)
+        self.assertEqual(Item.delete_by_wishlist_id(wishlists[0].id), (3, version + 1))
+        self.assertEqual(Wishlist.find_version(wishlists[0].id), version + 1)
+        self.assertEqual(Item.find_by_wishlist_id(wishlists[0].id).count(), 0)
+        self.assertEqual(Item.find_by_wishlist_id(wishlists[1].id).count(), 3)
+        self.assertEqual(Item.delete_by_wishlist_id(wishlists[0].id), (0, None))
+
     def test_find_by_wishlist_id_and_item_id(self):
         """It should find wishlist items by wishlist id and item id"""
         wishlist = WishlistFactory()
@@ -341,3 +477,270 @@ class TestItem(unittest.TestCase):
         wishlists = Wishlist.find_by_customer_id(wishlist.customer_id)
         for wishlist in wishlists:
             self.assertEqual(len(wishlist.items), 0)
+
+
+######################################################################
+#  W I S H L I S T   C A C H E   T E S T   C A S E S
+######################################################################
+class DictCacheBackend(CacheBackend):
+    """A Redis like store, shared by every instance and holding bytes"""
+
+    store = {}
+
+    def get(self, key):
+        value = self.store.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl: float):
+        self.store[key] = pickle.dumps(value)
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    def clear(self):
+        self.store.clear()
+
+
+class TestWishlistCache(unittest.TestCase):
+    """Test Cases for the Wishlist read-through cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.logger.setLevel(logging.CRITICAL)
+        Wishlist.init_db(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Wishlist).delete()  # clean up the last tests
+        db.session.commit()
+        cache.clear()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_lru_backend_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        backend = LRUCacheBackend(maxsize=2)
+        backend.set("a", 1, 60)
+        backend.set("b", 2, 60)
+        self.assertEqual(backend.get("a"), 1)
+        backend.set("c", 3, 60)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), 1)
+        self.assertEqual(backend.get("c"), 3)
+        self.assertEqual(len(backend), 2)
+
+    def test_lru_backend_expires_entries(self):
+        """It should not return entries older than their TTL"""
+        backend = LRUCacheBackend()
+        with patch("service.models.time.monotonic", return_value=100.0):
+            backend.set("a", 1, 10)
+        with patch("service.models.time.monotonic", return_value=109.0):
+            self.assertEqual(backend.get("a"), 1)
+        with patch("service.models.time.monotonic", return_value=110.0):
+            self.assertIsNone(backend.get("a"))
+        self.assertEqual(len(backend), 0)
+
+    def test_get_wishlist_reads_through(self):
+        """It should load a Wishlist once and then serve it from the cache"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        Item(
+            wishlist_id=wishlist.id, product_id=1, product_name="ball", product_price=1
+        ).create()
+
+        data = cache.get_wishlist(wishlist.id)
+        self.assertEqual(data["name"], wishlist.name)
+        self.assertEqual(len(data["items"]), 1)
+        with patch.object(Wishlist, "find") as find:
+            self.assertEqual(cache.get_wishlist(wishlist.id), data)
+            find.assert_not_called()
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        self.assertIsNone(cache.get_wishlist(0))
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_get_wishlist_disabled(self):
+        """It should not cache anything when the TTL is 0"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        with patch.object(cache, "ttl", 0):
+            self.assertEqual(cache.get_wishlist(wishlist.id)["id"], wishlist.id)
+            self.assertEqual(cache.get_wishlist(wishlist.id)["id"], wishlist.id)
+        self.assertEqual(cache.stats()["hits"], 0)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_writes_invalidate_the_cache(self):
+        """It should invalidate a Wishlist when it or its items are written"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        wishlist_id = wishlist.id
+
+        item = Item(
+            wishlist_id=wishlist_id, product_id=1, product_name="ball", product_price=1
+        )
+        other = Item(
+            wishlist_id=wishlist_id, product_id=2, product_name="bat", product_price=1
+        )
+
+        def update_item():
+            item.product_name = "glove"
+            item.update()
+
+        writes = [
+            item.create,
+            update_item,
+            other.create_or_get,
+            lambda: Wishlist.rename(wishlist_id, wishlist.customer_id, "Winter"),
+            lambda: Item.delete_by_wishlist_id(wishlist_id),
+        ]
+        for write in writes:
+            before = cache.get_wishlist(wishlist_id)
+            write()
+            self.assertNotEqual(cache.get_wishlist(wishlist_id), before)
+
+        Wishlist.find(wishlist_id).delete()
+        self.assertIsNone(cache.get_wishlist(wishlist_id))
+
+    def test_configured_backend(self):
+        """It should share the entries of a configured backend between workers"""
+        backend = app.config["WISHLIST_CACHE_BACKEND"]
+        app.config["WISHLIST_CACHE_BACKEND"] = "tests.test_models.DictCacheBackend"
+        self.addCleanup(cache.init_app, app)
+        self.addCleanup(app.config.update, WISHLIST_CACHE_BACKEND=backend)
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, DictCacheBackend)
+        other_worker = WishlistCache(DictCacheBackend())
+
+        wishlist = WishlistFactory()
+        wishlist.create()
+        data = cache.get_wishlist(wishlist.id)
+        self.assertEqual(other_worker.get_wishlist(wishlist.id), data)
+        self.assertEqual(other_worker.stats()["hits"], 1)
+
+        Item(
+            wishlist_id=wishlist.id, product_id=1, product_name="ball", product_price=1
+        ).create()
+        self.assertNotIn(cache.key(wishlist.id), DictCacheBackend.store)
+        self.assertEqual(len(other_worker.get_wishlist(wishlist.id)["items"]), 1)
+        self.assertEqual(other_worker.stats()["misses"], 1)
+        self.assertEqual(cache.get_wishlist(wishlist.id)["items"][0]["product_id"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertNotIn("size", cache.stats())
+
+    def test_get_wishlist_checks_version(self):
+        """It should not serve an entry older than the Wishlist"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        wishlist_id = wishlist.id
+        before = cache.get_wishlist(wishlist_id)
+
+        # written by another process, which cannot invalidate this cache
+        db.session.execute(
+            update(Wishlist).where(Wishlist.id == wishlist_id).values(name="Winter")
+        )
+        Wishlist.touch(wishlist_id)
+        db.session.commit()
+        data = cache.get_wishlist(wishlist_id)
+        self.assertEqual(data["name"], "Winter")
+        self.assertEqual(data["version"], before["version"] + 1)
+        self.assertEqual(cache.stats()["hits"], 0)
+
+        # stored by a concurrent miss that read the row before a write
+        cache.backend.set(cache.key(wishlist_id), before, 60)
+        self.assertEqual(cache.get_wishlist(wishlist_id), data)
+        self.assertEqual(cache.get_wishlist(wishlist_id), data)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+
+######################################################################
+#  Q U E R Y   P L A N   T E S T   C A S E S
+######################################################################
+@unittest.skipUnless(
+    DATABASE_URI.startswith("postgres"), "query plans are checked on PostgreSQL"
+)
+class TestQueryPlans(unittest.TestCase):
+    """Test Cases for the indexes used by the model finders"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.logger.setLevel(logging.CRITICAL)
+        Wishlist.init_db(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.close()
+
+    def setUp(self):
+        """This runs before each test"""
+        # the test tables are tiny, so make the planner prefer any usable index
+        db.session.execute("SET enable_seqscan = off")
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.rollback()
+        db.session.remove()
+
+    def _plan(self, query):
+        """Returns the PostgreSQL query plan of a model query as text"""
+        sql = query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        rows = db.session.execute(f"EXPLAIN {sql}")
+        return "\n".join(row[0] for row in rows)
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_find_by_wishlist_id_and_product_id_uses_index(self):
+        """It should use an index to find items by wishlist and product"""
+        plan = self._plan(Item.find_by_wishlist_id_and_product_id(1, 2))
+        self.assertIn("uq_item_wishlist_id_product_id", plan)
+
+    def test_find_by_wishlist_id_uses_index(self):
+        """It should use an index to find items by wishlist"""
+        plan = self._plan(Item.find_by_wishlist_id(1))
+        self.assertIn("uq_item_wishlist_id_product_id", plan)
+
+    def test_find_by_customer_id_uses_index(self):
+        """It should use an index to find wishlists by customer"""
+        plan = self._plan(Wishlist.find_by_customer_id(1))
+        self.assertIn("ix_wishlist_customer_id_name", plan)
+
+    def test_find_by_name_uses_index(self):
+        """It should use an index to find wishlists by name"""
+        plan = self._plan(Wishlist.find_by_name("Summer"))
+        self.assertIn("ix_wishlist_name", plan)
+
+    def test_find_version_uses_primary_key(self):
+        """It should look up a wishlist version by its primary key"""
+        query = db.session.query(Wishlist.version).filter(Wishlist.id == 1)
+        plan = self._plan(query)
+        self.assertIn("Index Scan using wishlist_pkey", plan)
+
+    def test_find_by_param_uses_index(self):
+        """It should use an index to find wishlists by customer and name"""
+        query = {"name": "Summer", "customer_id": 1}
+        plan = self._plan(Wishlist.find_by_param(query))
+        self.assertIn("ix_wishlist_customer_id_name", plan)
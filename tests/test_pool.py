@@ -0,0 +1,82 @@
+"""
+Test cases for the Database Connection Pool
+
+"""
+import sqlite3
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from service.utils.pool import TimedQueuePool, init_app, pool_stats
+
+OPTIONS = {
+    "pool_size": 2,
+    "max_overflow": 1,
+    "pool_timeout": 5,
+    "pool_recycle": 60,
+    "pool_pre_ping": True,
+}
+
+
+######################################################################
+#  C O N N E C T I O N   P O O L   T E S T   C A S E S
+######################################################################
+class TestConnectionPool(TestCase):
+    """Test Cases for the Connection Pool"""
+
+    def _pool(self, **kwargs):
+        pool = TimedQueuePool(lambda: sqlite3.connect(":memory:"), **kwargs)
+        self.addCleanup(pool.dispose)
+        return pool
+
+    def _init_app(self, uri):
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = uri
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(OPTIONS)
+        init_app(app)
+        return app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+
+    def test_init_app_postgres(self):
+        """It should use the timed pool with all of the options"""
+        options = self._init_app("postgresql://localhost/testdb")
+        self.assertEqual(options, dict(OPTIONS, poolclass=TimedQueuePool))
+
+    def test_init_app_sqlite(self):
+        """It should leave the SQLite pool alone but keep recycle and pre-ping"""
+        options = self._init_app("sqlite:///test.db")
+        self.assertEqual(options, {"pool_recycle": 60, "pool_pre_ping": True})
+
+    def test_pool_stats(self):
+        """It should report the connections checked out and in overflow"""
+        pool = self._pool(pool_size=1, max_overflow=2)
+        first = pool.connect()
+        second = pool.connect()
+        stats = pool_stats(pool)
+        self.assertEqual(stats["pool"], "TimedQueuePool")
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["max_overflow"], 2)
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 0)
+        first.close()
+        second.close()
+        stats = pool_stats(pool)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checked_in"], 1)
+
+    def test_pool_timeout(self):
+        """It should count the checkouts that time out waiting"""
+        pool = self._pool(pool_size=1, max_overflow=0, timeout=0.05)
+        connection = pool.connect()
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        connection.close()
+        stats = pool_stats(pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_time_max"], 0.05)
+        self.assertGreater(stats["wait_time_avg"], 0)
+
+    def test_other_pools(self):
+        """It should only name pools that are not a QueuePool"""
+        pool = NullPool(lambda: sqlite3.connect(":memory:"))
+        self.assertEqual(pool_stats(pool), {"pool": "NullPool"})
@@ -6,11 +6,16 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
 from unittest import TestCase
+from unittest.mock import ANY, patch
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 
 from service import app
 from service.models import db, init_db, Wishlist, Item
+from service.routes import database_check
 from service.utils import status  # HTTP Status Codes
 from tests.factories import WishlistFactory, ItemFactory
 
@@ -82,6 +87,66 @@ class TestWishlistServer(TestCase):
         data = response.get_json()
         self.assertEqual(data["status"], "OK")
 
+    def test_liveness(self):
+        """It should report the process is live"""
+        response = self.app.get("/health/live")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["status"], "OK")
+
+    def test_readiness(self):
+        """It should report ready when the database answers"""
+        database_check.reset()
+        response = self.app.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"status": "OK", "database": "OK"})
+
+    def test_readiness_pool_exhausted(self):
+        """It should report ready when the connection pool of the app is busy"""
+        database_check.reset()
+        self.addCleanup(database_check.reset)
+        error = TimeoutError("QueuePool limit reached")
+        with patch.object(db.engine, "connect", side_effect=error):
+            response = self.app.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_readiness_database_down(self):
+        """It should report unavailable, and cache it, when the database fails"""
+        database_check.reset()
+        self.addCleanup(database_check.reset)
+        error = OperationalError("SELECT 1", {}, Exception("connection refused"))
+        engine = database_check.engine()
+        with patch.object(engine, "connect", side_effect=error) as connect:
+            response = self.app.get("/health/ready")
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            data = response.get_json()
+            self.assertEqual(data["status"], "UNAVAILABLE")
+            self.assertEqual(data["database"], "OperationalError")
+            self.app.get("/health/ready")
+        self.assertEqual(connect.call_count, 1)
+
+    def test_cache_stats(self):
+        """It should return the wishlist cache counters"""
+        test_wishlist = self._create_wishlists(1)[0]
+        before = self.app.get("/admin/cache").get_json()
+        self.app.get(f"{BASE_URL}/{test_wishlist.id}")
+        self.app.get(f"{BASE_URL}/{test_wishlist.id}")
+        response = self.app.get("/admin/cache")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["misses"], before["misses"] + 1)
+        self.assertEqual(data["hits"], before["hits"] + 1)
+
+    def test_connection_pool_stats(self):
+        """It should return the connection pool statistics"""
+        self._create_wishlists(1)
+        response = self.app.get("/admin/pool")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertIn("pool", data)
+        if data["pool"] == "TimedQueuePool":
+            self.assertGreater(data["checkouts"], 0)
+            self.assertIn("wait_time_max", data)
+
     def test_index(self):
         """It should return the index page"""
         response = self.app.get("/")
@@ -97,6 +162,130 @@ class TestWishlistServer(TestCase):
         print(data)
         self.assertEqual(len(data), 7)
 
+    def _count_queries(self, url, method="get"):
+        """Issues a request against url and returns the number of SQL statements run"""
+        statements = []
+
+        def before_cursor_execute(*args):  # pylint: disable=unused-argument
+            statements.append(args[2])
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = getattr(self.app, method)(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(statements)
+
+    def test_get_wishlist_list_query_count(self):
+        """It should List Wishlists with a constant number of queries"""
+        for wishlist in self._create_wishlists(2):
+            for product_id in range(3):
+                ItemFactory(wishlist_id=wishlist.id, product_id=product_id).create()
+        db.session.expire_all()
+        few = self._count_queries(BASE_URL)
+
+        for wishlist in self._create_wishlists(6):
+            for product_id in range(3):
+                ItemFactory(wishlist_id=wishlist.id, product_id=product_id).create()
+        db.session.expire_all()
+        many = self._count_queries(BASE_URL)
+        self.assertEqual(few, many)
+
+        customer_id = self._create_wishlists(1)[0].customer_id
+        db.session.expire_all()
+        self.assertEqual(
+            few, self._count_queries(f"{BASE_URL}?customer_id={customer_id}")
+        )
+
+    def test_get_wishlist_list_paginated(self):
+        """It should page through Wishlists with a cursor"""
+        wishlists = self._create_wishlists(5)
+        response = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([w["id"] for w in data], [w.id for w in wishlists[:2]])
+        self.assertIn('rel="next"', response.headers["Link"])
+
+        seen = [w["id"] for w in data]
+        while "Link" in response.headers:
+            next_url = response.headers["Link"].split(";")[0].strip("<>")
+            response = self.app.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(w["id"] for w in response.get_json())
+        self.assertEqual(seen, [w.id for w in wishlists])
+
+        response = self.app.get(BASE_URL, query_string=f"cursor={wishlists[-1].id}")
+        self.assertEqual(response.get_json(), [])
+        self.assertNotIn("Link", response.headers)
+
+    def test_get_wishlist_list_max_page_size(self):
+        """It should not return more Wishlists than the maximum page size"""
+        self._create_wishlists(3)
+        app.config["WISHLIST_PAGE_SIZE_MAX"] = 2
+        try:
+            response = self.app.get(BASE_URL, query_string="limit=1000")
+        finally:
+            app.config["WISHLIST_PAGE_SIZE_MAX"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("limit=2", response.headers["Link"])
+
+    def test_get_wishlist_list_bad_limit(self):
+        """It should not List Wishlists with a bad page size"""
+        response = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_wishlist_list_slow_path(self):
+        """It should List the same Wishlists without the fast serializers"""
+        wishlists = self._create_wishlists(3)
+        for wishlist in wishlists:
+            req = {"product_id": 1, "product_name": "ball", "product_price": 10.5}
+            self.app.post(
+                f"{BASE_URL}/{wishlist.id}/items",
+                json=req,
+                content_type=CONTENT_TYPE_JSON,
+            )
+        fast = self.app.get(BASE_URL).get_json()
+        app.config["FAST_SERIALIZATION"] = False
+        try:
+            slow = self.app.get(BASE_URL).get_json()
+        finally:
+            app.config["FAST_SERIALIZATION"] = True
+        self.assertEqual(fast, slow)
+        self.assertEqual(fast[0]["items"][0]["product_price"], 10.5)
+
+    def test_export_wishlists(self):
+        """It should stream every Wishlist with its items as NDJSON"""
+        wishlists = self._create_wishlists(3)
+        for product_id in (1, 2):
+            req = {"product_id": product_id, "product_name": "ball", "product_price": 5}
+            self.app.post(
+                f"{BASE_URL}/{wishlists[1].id}/items",
+                json=req,
+                content_type=CONTENT_TYPE_JSON,
+            )
+
+        response = self.app.get(f"{BASE_URL}/export")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertTrue(response.is_streamed)
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([line["id"] for line in lines], [w.id for w in wishlists])
+        self.assertEqual(lines[0]["items"], [])
+        self.assertEqual([i["product_id"] for i in lines[1]["items"]], [1, 2])
+        self.assertEqual(lines[1]["items"][0]["product_price"], 5)
+        self.assertEqual(
+            lines[1], self.app.get(f"{BASE_URL}/{wishlists[1].id}").get_json()
+        )
+
+        customer_id = wishlists[2].customer_id
+        response = self.app.get(f"{BASE_URL}/export?customer_id={customer_id}")
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertIn(wishlists[2].id, [line["id"] for line in lines])
+        for line in lines:
+            self.assertEqual(line["customer_id"], customer_id)
+
     def test_get_wishlist(self):
         """It should Get a single Wishlist"""
         # get the id of a wishlist
@@ -205,6 +394,12 @@ class TestWishlistServer(TestCase):
         self.assertEqual(data["customer_id"], test_wishlist.customer_id)
         self.assertEqual(data["name"], test_wishlist.name)
         self.assertEqual(len(data["items"]), 0)
+        self.assertEqual(data["items_removed"], 1)
+        # the version after the clear, not the one before it
+        self.assertEqual(data["version"], Wishlist.find_version(test_wishlist.id))
+
+        response = self.app.get(f"{BASE_URL}/{test_wishlist.id}/items")
+        self.assertEqual(response.get_json(), [])
 
         response = self.app.put(
             BASE_URL + "/" + str(test_wishlist.id + 1) + "/clear",
@@ -212,6 +407,17 @@ class TestWishlistServer(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_clear_wishlist_query_count(self):
+        """It should Clear a Wishlist without reading it back"""
+        test_wishlist = self._create_wishlists(1)[0]
+        for product_id in range(3):
+            ItemFactory(wishlist_id=test_wishlist.id, product_id=product_id).create()
+        db.session.expire_all()
+        # the lookup, the DELETE and the version bump, which PostgreSQL returns
+        expected = 3 if db.engine.dialect.name == "postgresql" else 4
+        url = f"{BASE_URL}/{test_wishlist.id}/clear"
+        self.assertEqual(self._count_queries(url, "put"), expected)
+
     def test_get_wishlist_item_by_id(self):
         """It should Get a single Wishlist's item by id"""
         # get the id of a wishlist
@@ -244,6 +450,73 @@ class TestWishlistServer(TestCase):
         self.assertEqual(data["wishlist_id"], item.wishlist_id)
         self.assertEqual(data["product_id"], item.product_id)
 
+    def test_get_wishlist_not_modified(self):
+        """It should answer a conditional GET of an unchanged Wishlist with 304"""
+        test_wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{test_wishlist.id}"
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        self.assertEqual(response.get_json()["version"], 1)
+
+        response = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.data, b"")
+
+        req = {"product_id": 1, "product_name": "ball", "product_price": 10}
+        self.app.post(f"{url}/items", json=req, content_type=CONTENT_TYPE_JSON)
+        with patch.object(
+            Wishlist, "find_version", wraps=Wishlist.find_version
+        ) as find_version:
+            response = self.app.get(url, headers={"If-None-Match": etag})
+        # the version is looked up once, for the ETag and the cache
+        find_version.assert_called_once_with(test_wishlist.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.get_json()["items"]), 1)
+
+        response = self.app.get(f"{BASE_URL}/0", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_wishlist_items_not_modified(self):
+        """It should answer a conditional GET of unchanged items with 304"""
+        test_wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{test_wishlist.id}/items"
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+
+        response = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        req = {"product_id": 1, "product_name": "ball", "product_price": 10}
+        self.app.post(url, json=req, content_type=CONTENT_TYPE_JSON)
+        response = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_get_wishlist_with_fields_mask(self):
+        """It should return only the fields of the X-Fields mask"""
+        test_wishlist = self._create_wishlists(1)[0]
+        ItemFactory(wishlist_id=test_wishlist.id, product_id=1).create()
+        headers = {"X-Fields": "id"}
+        response = self.app.get(f"{BASE_URL}/{test_wishlist.id}", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"id": test_wishlist.id})
+
+        headers = {"X-Fields": "id,product_id"}
+        response = self.app.get(f"{BASE_URL}/{test_wishlist.id}/items", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [{"id": ANY, "product_id": 1}])
+
+    def test_fields_mask_documented(self):
+        """It should document the X-Fields header of the single Wishlist GETs"""
+        paths = self.app.get("/api/swagger.json").get_json()["paths"]
+        for path in ("/wishlists/{wishlist_id}", "/wishlists/{wishlist_id}/items"):
+            names = [param["name"] for param in paths[path]["get"]["parameters"]]
+            self.assertIn("X-Fields", names)
+
     def test_get_wishlist_not_found(self):
         """It should not Get a wishlist thats not found"""
         response = self.app.get(f"{BASE_URL}/0")
@@ -478,6 +751,33 @@ class TestWishlistServer(TestCase):
         self.assertEqual(test_wishlist.name, data["name"])
         self.assertEqual(new_wishlist["id"], data["id"])
         self.assertEqual(new_wishlist["customer_id"], data["customer_id"])
+        self.assertNotIn("items", data)
+
+        response = self.app.get(location, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(response.get_json()["name"], "Winter")
+
+    def test_update_wishlist_name_with_items(self):
+        """It should Update the name of a wishlist and return its items"""
+        test_wishlist = self._create_wishlists(1)[0]
+        req = {"product_id": 1, "product_name": "ball", "product_price": 10}
+        response = self.app.post(
+            f"{BASE_URL}/{test_wishlist.id}/items",
+            json=req,
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        test_wishlist.name = "Winter"
+        response = self.app.put(
+            f"{BASE_URL}/{test_wishlist.id}?items=true",
+            json=test_wishlist.serialize(),
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["name"], "Winter")
+        self.assertEqual(len(data["items"]), 1)
+        self.assertEqual(data["items"][0]["product_id"], 1)
 
     ######################################################################
     #  T E S T   S A D   P A T H S
@@ -633,6 +933,83 @@ class TestWishlistServer(TestCase):
         self.assertEqual(item.wishlist_id, data["wishlist_id"])
         self.assertEqual(item.product_id, data["product_id"])
 
+    def test_add_products_to_wishlist_in_bulk(self):
+        """It should add many products to a Wishlist in one request"""
+        test_wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{test_wishlist.id}/items:batch"
+        items = [
+            {
+                "product_id": product_id,
+                "product_name": f"product {product_id}",
+                "product_price": 10,
+            }
+            for product_id in (1, 2, 3)
+        ]
+
+        response = self.app.post(url, json=items[:2], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([row["status"] for row in data], ["created", "created"])
+
+        # one existing, one new and one repeated product
+        response = self.app.post(
+            url, json=items[1:] + items[2:], content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(
+            [row["status"] for row in data], ["existing", "created", "existing"]
+        )
+        self.assertEqual([row["product_id"] for row in data], [2, 3, 3])
+        self.assertEqual(data[1]["id"], data[2]["id"])
+        for row in data:
+            self.assertEqual(row["wishlist_id"], test_wishlist.id)
+
+        response = self.app.get(f"{BASE_URL}/{test_wishlist.id}/items")
+        self.assertEqual(len(response.get_json()), 3)
+
+    def test_add_products_to_wishlist_in_bulk_bad_data(self):
+        """It should not add products in bulk with bad data"""
+        test_wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{test_wishlist.id}/items:batch"
+        items = [
+            {"product_id": 1, "product_name": "ball", "product_price": 10},
+            {"product_id": 2, "product_price": 10},
+        ]
+        response = self.app.post(url, json=items, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        app.config["ITEM_BATCH_SIZE_MAX"] = 1
+        try:
+            response = self.app.post(
+                url, json=items[:1] * 2, content_type=CONTENT_TYPE_JSON
+            )
+        finally:
+            app.config["ITEM_BATCH_SIZE_MAX"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.app.get(f"{BASE_URL}/{test_wishlist.id}/items")
+        self.assertEqual(response.get_json(), [])
+
+    def test_add_products_to_wishlist_in_bulk_not_array(self):
+        """It should not add products in bulk from a single object"""
+        test_wishlist = self._create_wishlists(1)[0]
+        item = {"product_id": 1, "product_name": "ball", "product_price": 10}
+        response = self.app.post(
+            f"{BASE_URL}/{test_wishlist.id}/items:batch",
+            json=item,
+            content_type=CONTENT_TYPE_JSON,
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_products_to_wishlist_in_bulk_not_found(self):
+        """It should not add products in bulk to a Wishlist that does not exist"""
+        items = [{"product_id": 1, "product_name": "ball", "product_price": 10}]
+        response = self.app.post(
+            f"{BASE_URL}/0/items:batch", json=items, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_update_wishlist_item(self):
         """Updates wishlist item"""
         test_wishlist = WishlistFactory()
@@ -718,6 +1095,32 @@ class TestWishlistServer(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_wishlist_item_to_existing_product(self):
+        """It should not update an item to a product already in the Wishlist"""
+        test_wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{test_wishlist.id}/items"
+        ids = []
+        for product_id in (1, 2):
+            req = {
+                "product_id": product_id,
+                "product_name": "ball",
+                "product_price": 10,
+            }
+            response = self.app.post(url, json=req, content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            ids.append(response.get_json()["id"])
+
+        req = {"product_id": 1, "product_name": "bat", "product_price": 20}
+        response = self.app.put(
+            f"{url}/{ids[1]}", json=req, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("already in wishlist", response.get_json()["message"])
+
+        response = self.app.get(f"{url}/{ids[1]}")
+        self.assertEqual(response.get_json()["product_id"], 2)
+        self.assertEqual(response.get_json()["product_name"], "ball")
+
     def test_add_product_to_wishlist_does_not_exist(self):
         """Adds products to a wishlist, check where wishlist or customer does not exist"""
         test_wishlist = WishlistFactory()
@@ -0,0 +1,100 @@
+"""
+Test cases for the compiled serializers
+
+"""
+import json
+from decimal import Decimal
+from unittest import TestCase
+from flask_restx import marshal as restx_marshal
+from service import app
+from service.routes import wishlist_model, item_model, batch_item_model
+from service.utils import serializers
+from service.utils.serializers import compile_model, dumps
+
+
+def make_wishlist(items=3):
+    """Returns a serialized wishlist like the models produce"""
+    return {
+        "id": 1,
+        "name": "Summer",
+        "customer_id": 20,
+        "version": 2,
+        "items": [
+            {
+                "id": n,
+                "wishlist_id": 1,
+                "product_id": 100 + n,
+                "product_name": f"product {n}",
+                "product_price": Decimal("10.50"),
+            }
+            for n in range(items)
+        ],
+    }
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializers(TestCase):
+    """Test Cases for the compiled serializers"""
+
+    def test_compiled_matches_restx(self):
+        """It should serialize exactly like flask_restx.marshal"""
+        data = make_wishlist()
+        expected = restx_marshal(data, wishlist_model)
+        self.assertEqual(compile_model(wishlist_model)(data), expected)
+        self.assertEqual(list(compile_model(wishlist_model)(data)), list(expected))
+        item = data["items"][0]
+        self.assertEqual(
+            compile_model(item_model)(item), restx_marshal(item, item_model)
+        )
+
+    def test_compiled_missing_values(self):
+        """It should serialize missing values like flask_restx.marshal"""
+        data = {"id": 1, "name": "Summer", "customer_id": None, "items": []}
+        expected = restx_marshal(data, wishlist_model)
+        self.assertEqual(compile_model(wishlist_model)(data), expected)
+        data["items"] = None
+        expected = restx_marshal(data, wishlist_model, skip_none=True)
+        self.assertEqual(compile_model(wishlist_model, skip_none=True)(data), expected)
+        self.assertNotIn("items", expected)
+
+    def test_compiled_inherited_model(self):
+        """It should serialize the fields of parent models"""
+        item = dict(make_wishlist()["items"][0], status="created")
+        expected = restx_marshal(item, batch_item_model)
+        self.assertEqual(compile_model(batch_item_model)(item), expected)
+
+    def test_marshal_list(self):
+        """It should marshal a list of dicts"""
+        data = [make_wishlist(), make_wishlist(0)]
+        with app.test_request_context():
+            self.assertEqual(
+                serializers.marshal(data, wishlist_model),
+                restx_marshal(data, wishlist_model),
+            )
+
+    def test_marshal_with_mask_uses_restx(self):
+        """It should leave field masks to flask_restx and apply them"""
+        headers = {app.config["RESTX_MASK_HEADER"]: "{id,name}"}
+        with app.test_request_context(headers=headers):
+            self.assertFalse(serializers.use_fast_path())
+            self.assertEqual(
+                serializers.marshal(make_wishlist(), wishlist_model),
+                {"id": 1, "name": "Summer"},
+            )
+            self.assertEqual(
+                serializers.marshal(make_wishlist(), wishlist_model, mask="id"),
+                {"id": 1},
+            )
+        self.assertEqual(
+            serializers.marshal(make_wishlist(), wishlist_model, mask="name"),
+            {"name": "Summer"},
+        )
+
+    def test_dumps(self):
+        """It should encode Decimals as JSON numbers"""
+        data = restx_marshal(make_wishlist(), wishlist_model)
+        self.assertEqual(json.loads(dumps(data)), json.loads(json.dumps(data)))
+        self.assertEqual(json.loads(dumps({"price": Decimal("1.5")})), {"price": 1.5})
+        self.assertRaises(TypeError, dumps, {"bad": object()})